@@ -0,0 +1,160 @@
+import os
+import sys
+import json
+import time
+import statistics
+import tracemalloc
+import scraper
+
+# --- BENCHMARK OFFLINE DELL'ESTRAZIONE ---
+# Misura velocità, memoria e accuratezza di scraper.estrai_dati_prodotto (usata sia da
+# ProfitBot che dal Cruiser) su pagine prodotto salvate, senza rete.
+#
+# La cartella del corpus contiene le pagine (<nome>.html) e un expected.json con i valori attesi:
+#   {"<nome>.html": {"categoria": "lampo", "titolo": "...", "prezzo": "19,99€", "esaurito": false, "captcha": false}}
+# Il corpus nel repository è anonimizzato (normale, lampo, variazioni, esaurito, captcha e i casi che
+# il percorso veloce sbagliava) e gira senza rete: `python benchmark_scraper.py` esce con 1 se una pagina regredisce.
+# Altre pagine si aggiungono con `python benchmark_scraper.py registra <url> <nome> [categoria]`:
+# i valori attesi vengono proposti dall'estrazione attuale e vanno controllati a mano.
+CORPUS_DIR = os.getenv('BENCHMARK_CORPUS', "corpus_pagine")
+ATTESI_FILE = "expected.json"
+RIPETIZIONI = 20
+
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/100.0.4896.127 Safari/537.36',
+    'Accept-Language': 'it-IT,it;q=0.9,en-US;q=0.8,en;q=0.7',
+}
+
+
+def _esaurito(disponibilita):
+    """Stessa regola del Cruiser per l'esaurimento scorte."""
+    testo = (disponibilita or "").lower()
+    return "non disponibile" in testo or "currently unavailable" in testo
+
+
+def _leggi_attesi(cartella):
+    percorso = os.path.join(cartella, ATTESI_FILE)
+    if not os.path.exists(percorso):
+        return {}
+    with open(percorso, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _scrivi_attesi(cartella, attesi):
+    percorso = os.path.join(cartella, ATTESI_FILE)
+    tmp = percorso + ".tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(attesi, f, ensure_ascii=False, indent=2, sort_keys=True)
+    os.replace(tmp, percorso)
+
+
+def misura_pagina(contenuto, ripetizioni=RIPETIZIONI):
+    """Estrae `ripetizioni` volte la stessa pagina: (dati, tempi in ms, picco di memoria in KB, tempo solo-bs4 in ms)."""
+    tempi = []
+    for _ in range(ripetizioni):
+        inizio = time.perf_counter()
+        dati = scraper.estrai_dati_prodotto(contenuto)
+        tempi.append(1000 * (time.perf_counter() - inizio))
+
+    tracemalloc.start()
+    scraper.estrai_dati_prodotto(contenuto)
+    _, picco = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # Riferimento: quanto costerebbe la stessa pagina passando sempre da BeautifulSoup
+    inizio = time.perf_counter()
+    scraper._estrai_bs4(contenuto, list(scraper.CATENA_PREZZO))
+    tempo_bs4 = 1000 * (time.perf_counter() - inizio)
+    return dati, tempi, picco / 1024, tempo_bs4
+
+
+def confronta(dati, contenuto, atteso):
+    """Campi sbagliati rispetto ai valori attesi (lista vuota = pagina estratta correttamente)."""
+    errori = []
+    captcha = b"captcha" in contenuto.lower()
+    if captcha != atteso.get('captcha', False):
+        errori.append(f"captcha {captcha} invece di {atteso.get('captcha', False)}")
+    if atteso.get('captcha'):
+        return errori
+    if 'titolo' in atteso and (dati['titolo'] or "") != atteso['titolo']:
+        errori.append(f"titolo {dati['titolo']!r}")
+    if 'prezzo' in atteso and dati['prezzo'] != atteso['prezzo']:
+        errori.append(f"prezzo {dati['prezzo']!r} invece di {atteso['prezzo']!r}")
+    if 'esaurito' in atteso and _esaurito(dati['disponibilita']) != atteso['esaurito']:
+        errori.append(f"esaurito {_esaurito(dati['disponibilita'])} invece di {atteso['esaurito']}")
+    return errori
+
+
+def esegui(cartella=CORPUS_DIR, ripetizioni=RIPETIZIONI):
+    """Benchmark su tutto il corpus. True se tutte le pagine con valori attesi sono estratte correttamente."""
+    attesi = _leggi_attesi(cartella)
+    pagine = sorted(nome for nome in os.listdir(cartella) if nome.endswith('.html')) if os.path.isdir(cartella) else []
+    if not pagine:
+        print(f"❌ Nessuna pagina .html in {cartella}. Aggiungile con: python benchmark_scraper.py registra <url> <nome> [categoria]")
+        return False
+
+    print(f"{'PAGINA':<32} {'CATEG.':<11} {'KB':>6} {'PERC.':<7} {'MEDIANA':>9} {'P95':>9} {'SOLO BS4':>9} {'MEM KB':>8}  ESITO")
+    righe, corrette, verificate = [], 0, 0
+    for nome in pagine:
+        with open(os.path.join(cartella, nome), 'rb') as f:
+            contenuto = f.read()
+        dati, tempi, picco_kb, tempo_bs4 = misura_pagina(contenuto, ripetizioni)
+        tempi.sort()
+        mediana = statistics.median(tempi)
+        p95 = tempi[min(len(tempi) - 1, int(0.95 * len(tempi)))]
+        atteso = attesi.get(nome)
+        if atteso is None:
+            esito = "— nessun valore atteso"
+        else:
+            verificate += 1
+            errori = confronta(dati, contenuto, atteso)
+            corrette += not errori
+            esito = "✅" if not errori else "❌ " + "; ".join(errori)
+        categoria = (atteso or {}).get('categoria', '?')
+        print(f"{nome[:32]:<32} {categoria[:11]:<11} {len(contenuto) / 1024:>6.0f} {dati['percorso']:<7} "
+              f"{mediana:>7.2f}ms {p95:>7.2f}ms {tempo_bs4:>7.1f}ms {picco_kb:>8.0f}  {esito}")
+        righe.append((dati['percorso'], mediana, picco_kb))
+
+    print()
+    for percorso in ('veloce', 'bs4'):
+        del_percorso = [r for r in righe if r[0] == percorso]
+        if del_percorso:
+            print(f"⏱️ Percorso {percorso}: {len(del_percorso)} pagine, mediana media {statistics.mean(r[1] for r in del_percorso):.2f} ms, "
+                  f"picco memoria max {max(r[2] for r in del_percorso):.0f} KB")
+    if verificate:
+        print(f"🎯 Accuratezza: {corrette}/{verificate} pagine ({100 * corrette / verificate:.1f}%)")
+    return corrette == verificate
+
+
+def registra(url, nome, categoria="normale", cartella=CORPUS_DIR):
+    """Scarica una pagina per il corpus e propone i valori attesi con l'estrazione attuale."""
+    os.makedirs(cartella, exist_ok=True)
+    nome_file = nome if nome.endswith('.html') else nome + '.html'
+    risposta = scraper.scarica(url, headers=HEADERS, timeout=15)
+    contenuto = risposta.content
+    with open(os.path.join(cartella, nome_file), 'wb') as f:
+        f.write(contenuto)
+
+    dati = scraper.estrai_dati_prodotto(contenuto)
+    captcha = b"captcha" in contenuto.lower()
+    atteso = {'categoria': categoria, 'captcha': captcha}
+    if not captcha:
+        atteso.update({'titolo': dati['titolo'] or "", 'prezzo': dati['prezzo'], 'esaurito': _esaurito(dati['disponibilita'])})
+    attesi = _leggi_attesi(cartella)
+    attesi[nome_file] = atteso
+    _scrivi_attesi(cartella, attesi)
+    print(f"✅ Salvata {nome_file} ({len(contenuto) // 1024} KB, status {risposta.status_code}).")
+    print(f"⚠️ Controlla a mano i valori attesi in {os.path.join(cartella, ATTESI_FILE)}: {atteso}")
+
+
+if __name__ == '__main__':
+    comando = sys.argv[1] if len(sys.argv) > 1 else "esegui"
+    if comando == "esegui":
+        cartella = sys.argv[2] if len(sys.argv) > 2 else CORPUS_DIR
+        ripetizioni = int(sys.argv[3]) if len(sys.argv) > 3 else RIPETIZIONI
+        sys.exit(0 if esegui(cartella, ripetizioni) else 1)
+    elif comando == "registra" and len(sys.argv) >= 4:
+        registra(sys.argv[2], sys.argv[3], sys.argv[4] if len(sys.argv) > 4 else "normale")
+    else:
+        print("❌ Uso: python benchmark_scraper.py [esegui [cartella] [ripetizioni]] | registra <url> <nome> [categoria]")
+        sys.exit(1)
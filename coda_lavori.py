@@ -0,0 +1,152 @@
+import os
+import time
+import socket
+import sqlite3
+import threading
+
+# --- CONFIGURAZIONE CODA LAVORI (Cruiser coordinatore + worker) ---
+# Il coordinatore mette in coda un lavoro per ogni ASIN da controllare, i worker li prendono
+# in prestito (lease), scaricano la pagina e scrivono il risultato nella stessa coda.
+# La coda è un file SQLite: sopravvive ai riavvii e può essere usata da worker su altre macchine
+# solo se il file sta su un disco condiviso con lock affidabili (non NFS).
+CODA_FILE = os.getenv('CODA_LAVORI_FILE', "coda_lavori.sqlite")
+# Un lavoro preso da un worker che non risponde entro LEASE_SECONDI torna disponibile agli altri
+LEASE_SECONDI = int(os.getenv('CODA_LEASE_SECONDI', '300'))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS lavori (
+    asin TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    creato REAL NOT NULL,
+    worker TEXT,
+    scadenza REAL,
+    tentativi INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_lavori_creato ON lavori(creato);
+CREATE TABLE IF NOT EXISTS risultati (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    asin TEXT NOT NULL,
+    titolo TEXT,
+    prezzo REAL,
+    link TEXT,
+    worker TEXT,
+    finito REAL
+);
+"""
+
+_locale = threading.local()
+
+
+def _connessione():
+    """Una connessione per thread, con lo schema garantito alla prima apertura."""
+    conn = getattr(_locale, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(CODA_FILE, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(SCHEMA)
+        _locale.conn = conn
+    return conn
+
+
+def id_worker():
+    """Identificativo del processo worker: host e PID."""
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+# --- LATO COORDINATORE ---
+def accoda(asin, url):
+    """Mette in coda il controllo dell'ASIN. False se c'è già un lavoro aperto per lo stesso ASIN.
+
+    Un ASIN ha al massimo un lavoro aperto: finché non torna il risultato non può essere controllato di nuovo.
+    """
+    cur = _connessione().execute(
+        "INSERT OR IGNORE INTO lavori (asin, url, creato) VALUES (?, ?, ?)", (asin, url, time.time())
+    )
+    return cur.rowcount == 1
+
+
+def lavori_aperti():
+    """ASIN con un lavoro in coda o in corso."""
+    return {row[0] for row in _connessione().execute("SELECT asin FROM lavori")}
+
+
+def raccogli_risultati(limite=100):
+    """Risultati arrivati dai worker, dal più vecchio: [(asin, titolo, prezzo, link, worker)]. Vengono consumati."""
+    conn = _connessione()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        righe = conn.execute(
+            "SELECT id, asin, titolo, prezzo, link, worker FROM risultati ORDER BY id LIMIT ?", (limite,)
+        ).fetchall()
+        if righe:
+            conn.execute("DELETE FROM risultati WHERE id <= ?", (righe[-1][0],))
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return [row[1:] for row in righe]
+
+
+def worker_attivi():
+    """Worker che hanno in questo momento almeno un lavoro con lease valido."""
+    return {row[0] for row in _connessione().execute("SELECT DISTINCT worker FROM lavori WHERE scadenza >= ?", (time.time(),))}
+
+
+def statistiche():
+    """Lavori in attesa, in corso (lease valido), risultati da raccogliere e worker attivi."""
+    conn = _connessione()
+    adesso = time.time()
+    in_attesa, in_corso = conn.execute(
+        "SELECT COALESCE(SUM(scadenza IS NULL OR scadenza < ?), 0), COALESCE(SUM(scadenza >= ?), 0) FROM lavori",
+        (adesso, adesso)
+    ).fetchone()
+    risultati = conn.execute("SELECT COUNT(*) FROM risultati").fetchone()[0]
+    worker = conn.execute("SELECT COUNT(DISTINCT worker) FROM lavori WHERE scadenza >= ?", (adesso,)).fetchone()[0]
+    return {'in_attesa': in_attesa, 'in_corso': in_corso, 'risultati': risultati, 'worker_attivi': worker}
+
+
+# --- LATO WORKER ---
+def prendi(worker, limite=1, lease=None):
+    """Prende in prestito fino a `limite` lavori liberi o con lease scaduto: [(asin, url)]."""
+    if limite <= 0:
+        return []
+    lease = LEASE_SECONDI if lease is None else lease
+    conn = _connessione()
+    adesso = time.time()
+    # BEGIN IMMEDIATE: due worker non possono prendere lo stesso lavoro
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        righe = conn.execute(
+            "SELECT asin, url FROM lavori WHERE scadenza IS NULL OR scadenza < ? ORDER BY creato LIMIT ?",
+            (adesso, limite)
+        ).fetchall()
+        conn.executemany(
+            "UPDATE lavori SET worker = ?, scadenza = ?, tentativi = tentativi + 1 WHERE asin = ?",
+            [(worker, adesso + lease, asin) for asin, _ in righe]
+        )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return righe
+
+
+def completa(worker, asin, titolo=None, prezzo=None, link=None):
+    """Chiude il lavoro e registra il risultato (prezzo None = controllo fallito).
+
+    False se nel frattempo il lease è scaduto e il lavoro è passato a un altro worker: il risultato viene scartato.
+    """
+    conn = _connessione()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        cur = conn.execute("DELETE FROM lavori WHERE asin = ? AND worker = ?", (asin, worker))
+        if cur.rowcount == 1:
+            conn.execute(
+                "INSERT INTO risultati (asin, titolo, prezzo, link, worker, finito) VALUES (?, ?, ?, ?, ?, ?)",
+                (asin, titolo, prezzo, link, worker, time.time())
+            )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return cur.rowcount == 1
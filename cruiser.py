@@ -1,24 +1,73 @@
 import os
+import sys
 import time
 import re
+import asyncio
+import heapq
+import json
+import threading
+import urllib.parse
 import requests
-from bs4 import BeautifulSoup
-from openpyxl import Workbook, load_workbook
 from datetime import datetime
 from dotenv import load_dotenv
 import telebot
 import random
 import traceback
+import registro
+import scraper
+import coda_lavori
 
 # --- CONFIGURAZIONE ---
 load_dotenv()
 # Assicurati che TELEGRAM_BOT_TOKEN e FABRIZIO_CHAT_ID siano nel tuo file .env
 API_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN') 
 FABRIZIO_CHAT_ID = os.getenv('FABRIZIO_CHAT_ID') 
-DB_FILE = "Registro_Vendite.xlsx"
 WATCHLIST_FILE = "watchlist.txt"
 AMAZON_TAG = 'radartest-21' 
 
+# --- MOTORE DI SCRAPING CONCORRENTE ---
+# Richieste contemporanee al massimo e budget di cortesia per host (token bucket):
+# RICHIESTE_AL_SECONDO per host in media, con raffiche fino a BURST_RICHIESTE.
+# 0.1 req/s equivale in media alla vecchia pausa casuale di 5-15 secondi.
+CONCORRENZA_MAX = int(os.getenv('CRUISER_CONCORRENZA', '4'))
+RICHIESTE_AL_SECONDO = float(os.getenv('CRUISER_RICHIESTE_AL_SECONDO', '0.1'))
+BURST_RICHIESTE = int(os.getenv('CRUISER_BURST', '1'))
+
+# --- SCHEDULER ADATTIVO ---
+# Ogni ASIN viene ricontrollato dopo un intervallo tra INTERVALLO_MIN e INTERVALLO_MAX:
+# più corto per i prodotti che cambiano prezzo spesso o hanno avuto un ribasso di recente.
+# Se la watchlist chiederebbe più di BUDGET_RICHIESTE_ORA controlli l'ora, tutti gli intervalli si allungano.
+# È il budget di un processo: di default il ritmo per host di ogni uscita (proxy) configurata, sommato;
+# in modalità coordinatore viene moltiplicato per i worker attivi.
+INTERVALLO_MIN = int(os.getenv('CRUISER_INTERVALLO_MIN_SECONDI', '900'))
+INTERVALLO_MAX = int(os.getenv('CRUISER_INTERVALLO_MAX_SECONDI', '21600'))
+BUDGET_RICHIESTE_ORA = int(os.getenv('CRUISER_BUDGET_RICHIESTE_ORA', str(int(RICHIESTE_AL_SECONDO * 3600 * len(scraper.uscite())))))
+RICARICA_INDICE_SECONDI = 300
+# Ogni quanto al massimo il ciclo si risveglia: controlla anche se watchlist.txt è cambiata
+RISVEGLIO_SECONDI = 5.0
+# Opzione priorita= della watchlist: moltiplica l'intervallo tra un controllo e l'altro
+PRIORITA = {'alta': 0.5, 'normale': 1.0, 'bassa': 2.0}
+STATISTICHE_OGNI_SECONDI = 600
+
+# Stato dello scheduler salvato su disco: dopo un riavvio si riprende da dove ci si era fermati
+CHECKPOINT_FILE = "cruiser_checkpoint.json"
+CHECKPOINT_OGNI_SECONDI = int(os.getenv('CRUISER_CHECKPOINT_SECONDI', '30'))
+
+# --- COORDINATORE E WORKER ---
+# `python cruiser.py coordinatore` decide cosa controllare e registra i ribassi,
+# `python cruiser.py worker` (uno o più processi) scarica le pagine dalla coda in coda_lavori.py.
+# Lavori aperti al massimo in coda: oltre, il coordinatore aspetta che i worker smaltiscano.
+CODA_MAX_APERTI = int(os.getenv('CRUISER_CODA_MAX_APERTI', '200'))
+
+# --- CONTROLLO DEL RITMO E CIRCUIT BREAKER ---
+# Ogni risposta OK alza il ritmo dell'host di un passo (fino a RICHIESTE_AL_SECONDO), ogni blocco
+# (503/429/CAPTCHA) lo dimezza, ogni timeout lo riduce di un quarto (AIMD).
+# Dopo SOGLIA_BLOCCHI blocchi consecutivi il circuito si apre: nessuna richiesta per PAUSA_BLOCCO secondi,
+# poi una sola richiesta di prova; se va bene si riparte, altrimenti la pausa raddoppia (fino a PAUSA_BLOCCO_MAX).
+SOGLIA_BLOCCHI = int(os.getenv('CRUISER_SOGLIA_BLOCCHI', '3'))
+PAUSA_BLOCCO = int(os.getenv('CRUISER_PAUSA_BLOCCO_SECONDI', '3600'))
+PAUSA_BLOCCO_MAX = int(os.getenv('CRUISER_PAUSA_BLOCCO_MAX_SECONDI', '21600'))
+
 bot = telebot.TeleBot(API_TOKEN)
 print("✅ Cruiser Bot Avviato. Monitoraggio DB.")
 
@@ -45,58 +94,51 @@ def handle_critical_error(e, context="CRUISER"):
     print(message) 
 
 def clean_price_calc(price_str):
-    if not isinstance(price_str, str): return 0.0
-    price_str = price_str.replace('€', '').replace('$', '').strip()
-    # Logica per gestire il separatore decimale italiano
-    if price_str.count(',') == 1 and price_str.count('.') <= 1 and price_str.rfind(',') > price_str.rfind('.'):
-        price_str = price_str.replace('.', '')
-        price_str = price_str.replace(',', '.')
-    else:
-        price_str = price_str.replace(',', '') 
-        
-    try:
-        return float(price_str)
-    except ValueError:
-        return 0.0 
+    # Stesso parser del registro (riassunto giornaliero): un solo posto da correggere
+    return registro.valore_prezzo(price_str)
 
 def format_price_for_excel(val_float):
     return "{:.2f}".format(val_float).replace('.', ',')
 
-def get_last_price_from_db(asin):
-    if not os.path.exists(DB_FILE): return 0.0, 0.0
+# --- INDICE PREZZI IN MEMORIA ---
+# ASIN -> (ultimo prezzo, prezzo precedente, ultimo visto). Costruito una volta all'avvio,
+# poi aggiornato a ogni salvataggio e, a inizio ciclo, con le sole righe nuove del registro
+# (es. i post pubblicati da ProfitBot).
+indice_prezzi = {}
+_indice_ultimo_id = 0
+
+def _aggiorna_indice_da_righe(righe):
+    global _indice_ultimo_id
+    for row in righe:
+        id_riga, data, ora, asin = row[0], row[1], row[2], row[3]
+        if asin:
+            indice_prezzi[asin] = (clean_price_calc(row[6]), clean_price_calc(row[5]), f"{data} {ora}")
+        _indice_ultimo_id = max(_indice_ultimo_id, id_riga)
+
+def carica_indice_prezzi():
+    global _indice_ultimo_id
     try:
-        wb = load_workbook(DB_FILE)
-        ws = wb.active
-        for row in reversed(list(ws.iter_rows(min_row=2, values_only=True))):
-            db_asin = row[2]
-            if db_asin == asin:
-                # [5] Nuovo Prezzo è il più recente registrato
-                return clean_price_calc(row[5]), clean_price_calc(row[4]) 
-        return 0.0, 0.0
+        indice_prezzi.clear()
+        _indice_ultimo_id = 0
+        _aggiorna_indice_da_righe(registro.ultime_vendite_per_asin())
+        print(f"📇 Indice prezzi caricato: {len(indice_prezzi)} ASIN.")
     except Exception as e:
         handle_critical_error(e, "DB_READ")
-        return 0.0, 0.0
 
-def salva_in_excel(dati, tipo_pubblicazione="CRUISER_MONITOR"):
-    adesso = datetime.now()
+def aggiorna_indice_prezzi():
     try:
-        if not os.path.exists(DB_FILE):
-             # Crea un nuovo file se non esiste
-             wb = Workbook()
-             ws = wb.active
-             ws.title = "Registro Vendite"
-             ws.append(["DATA", "ORA", "ASIN", "TITOLO", "PREZZO_VECCHIO", "PREZZO_NUOVO", "LINK_AFFILIATO", "FILE_ID", "TIPO_PUBBLICAZIONE"])
-        else:
-            wb = load_workbook(DB_FILE)
-            ws = wb.active
+        _aggiorna_indice_da_righe(registro.vendite_dopo(_indice_ultimo_id))
+    except Exception as e:
+        handle_critical_error(e, "DB_READ")
 
-        # Assicurati che la colonna TIPO_PUBBLICAZIONE esista
-        if ws.cell(row=1, column=9).value != "TIPO_PUBBLICAZIONE":
-            ws.cell(row=1, column=9, value="TIPO_PUBBLICAZIONE")
-        
-        ws.append([
-            adesso.strftime("%d/%m/%Y"), 
-            adesso.strftime("%H:%M:%S"), 
+def get_last_price_from_db(asin):
+    # [0] Nuovo Prezzo è il più recente registrato, [1] il prezzo vecchio della stessa riga
+    ultimo, precedente, _ = indice_prezzi.get(asin, (0.0, 0.0, None))
+    return ultimo, precedente
+
+def salva_in_excel(dati, tipo_pubblicazione="CRUISER_MONITOR"):
+    try:
+        registro.registra_vendita(
             dati.get('asin', 'N/A'), 
             dati.get('titolo', 'Nessun Titolo'), 
             dati.get('old_price_db_save', '0,00'), 
@@ -104,24 +146,209 @@ def salva_in_excel(dati, tipo_pubblicazione="CRUISER_MONITOR"):
             dati.get('link_aff', ''),
             'CRUISER_N/A', 
             tipo_pubblicazione
-        ])
-        wb.save(DB_FILE)
+        )
+        indice_prezzi[dati.get('asin', 'N/A')] = (
+            clean_price_calc(dati.get('new_price_scraped_save', '0,00')),
+            clean_price_calc(dati.get('old_price_db_save', '0,00')),
+            datetime.now().strftime("%d/%m/%Y %H:%M:%S")
+        )
         return True
     except Exception as e:
         handle_critical_error(e, "DB_WRITE")
         return False
 
-# --- FUNZIONE WEB SCRAPING GENTILE (VERS. DEFINITIVA) ---
-def get_product_data_gentle(url):
-    """Estrae titolo e prezzo corrente da un link Amazon con logica di fallback e OOS."""
-    
+# --- BUDGET DI CORTESIA PER HOST ---
+class TokenBucket:
+    """Token bucket thread-safe: `rate` richieste al secondo, raffiche fino a `capacita`."""
+
+    def __init__(self, rate, capacita=1):
+        self.rate = rate
+        self.capacita = capacita
+        self.token = float(capacita)
+        self._ultimo = time.monotonic()
+        self._lock = threading.Lock()
+
+    def prenota(self):
+        """Prenota un token e restituisce quanti secondi aspettare prima di usarlo."""
+        with self._lock:
+            adesso = time.monotonic()
+            self.token = min(self.capacita, self.token + (adesso - self._ultimo) * self.rate)
+            self._ultimo = adesso
+            self.token -= 1
+            return max(0.0, -self.token / self.rate)
+
+    def imposta_rate(self, rate):
+        """Cambia il ritmo senza perdere i token già maturati col ritmo precedente."""
+        with self._lock:
+            adesso = time.monotonic()
+            self.token = min(self.capacita, self.token + (adesso - self._ultimo) * self.rate)
+            self._ultimo = adesso
+            self.rate = rate
+
+    def attesa_stimata(self):
+        """Secondi da aspettare per il prossimo token, senza prenotarlo."""
+        with self._lock:
+            token = min(self.capacita, self.token + (time.monotonic() - self._ultimo) * self.rate)
+            return max(0.0, (1 - token) / self.rate)
+
+    async def attendi(self):
+        attesa = self.prenota()
+        if attesa > 0:
+            await asyncio.sleep(attesa)
+
+_bucket_per_host = {}
+
+def bucket_per_host(host):
+    if host not in _bucket_per_host:
+        _bucket_per_host[host] = TokenBucket(RICHIESTE_AL_SECONDO, BURST_RICHIESTE)
+    return _bucket_per_host[host]
+
+ESITO_OK = 'ok'
+ESITO_BLOCCO = 'blocco'
+ESITO_TIMEOUT = 'timeout'
+ESITO_ERRORE = 'errore'
+
+class ControlloreRitmo:
+    """Regola il token bucket di un host in base agli esiti delle richieste e apre il circuito sui blocchi.
+
+    Stati del circuito: 'chiuso' (si lavora), 'aperto' (pausa dopo un blocco), 'prova' (una sola richiesta in volo).
+    """
+
+    def __init__(self, host, bucket):
+        self.host = host
+        self.bucket = bucket
+        self.rate_max = bucket.rate
+        self.rate_min = bucket.rate / 16
+        self.stato = 'chiuso'
+        self.blocchi_consecutivi = 0
+        self.aperture = 0
+        self.pausa = PAUSA_BLOCCO
+        self.riapertura = 0.0
+        self.esiti = {ESITO_OK: 0, ESITO_BLOCCO: 0, ESITO_TIMEOUT: 0, ESITO_ERRORE: 0}
+        self._prova_in_volo = False
+        self._lock = threading.Lock()
+
+    def registra(self, esito):
+        """Esito di una richiesta all'host (chiamata dai thread di scraping)."""
+        apri = False
+        with self._lock:
+            self.esiti[esito] += 1
+            rate = self.bucket.rate
+            if esito == ESITO_OK:
+                self.blocchi_consecutivi = 0
+                rate = min(self.rate_max, rate + self.rate_max / 10)
+                if self.stato == 'prova':
+                    print(f"🟢 Circuito {self.host} richiuso: si riparte a {rate:.3f} req/s.")
+                    self.stato = 'chiuso'
+                    self.pausa = PAUSA_BLOCCO
+                    self._prova_in_volo = False
+            elif esito == ESITO_BLOCCO:
+                self.blocchi_consecutivi += 1
+                rate = max(self.rate_min, rate / 2)
+                if self.stato == 'prova':
+                    self.pausa = min(PAUSA_BLOCCO_MAX, self.pausa * 2)
+                    apri = True
+                elif self.stato == 'chiuso' and self.blocchi_consecutivi >= SOGLIA_BLOCCHI:
+                    apri = True
+            elif esito == ESITO_TIMEOUT:
+                rate = max(self.rate_min, rate * 0.75)
+            if esito != ESITO_OK and self.stato == 'prova' and not apri:
+                # Prova non conclusiva (timeout/errore): se ne farà un'altra
+                self._prova_in_volo = False
+            self.bucket.imposta_rate(rate)
+            if apri:
+                self.stato = 'aperto'
+                self.aperture += 1
+                self._prova_in_volo = False
+                self.riapertura = time.monotonic() + self.pausa
+        if apri:
+            print(f"🔴 Circuito {self.host} aperto dopo {self.blocchi_consecutivi} blocchi. Pausa di {self.pausa}s.")
+            if len(scraper.uscite()) > 1:
+                testo = (f"⚠️ **BLOCCO AMAZON RILEVATO** su `{self.host}`. Questa uscita resta ferma per "
+                         f"{self.pausa // 60} minuti, poi riprova da sola; le altre uscite continuano.")
+            else:
+                testo = f"⚠️ **BLOCCO AMAZON RILEVATO.** Il cruiser è in pausa per {self.pausa // 60} minuti, poi riprova da solo."
+            try:
+                bot.send_message(FABRIZIO_CHAT_ID, testo, parse_mode='Markdown')
+            except Exception as e:
+                handle_critical_error(e, "TELEGRAM_NOTIFY")
+
+    def attesa(self):
+        """0 se si può inviare una richiesta adesso, altrimenti i secondi da aspettare prima di richiedere."""
+        with self._lock:
+            if self.stato == 'chiuso':
+                return 0.0
+            adesso = time.monotonic()
+            if self.stato == 'aperto':
+                if adesso < self.riapertura:
+                    return self.riapertura - adesso
+                self.stato = 'prova'
+            if self._prova_in_volo:
+                return 5.0
+            self._prova_in_volo = True
+            return 0.0
+
+    async def attendi(self):
+        while True:
+            attesa = self.attesa()
+            if attesa <= 0:
+                return
+            await asyncio.sleep(min(attesa, 60))
+
+_controllore_per_host = {}
+
+def controllore_per_host(host):
+    if host not in _controllore_per_host:
+        _controllore_per_host[host] = ControlloreRitmo(host, bucket_per_host(host))
+    return _controllore_per_host[host]
+
+def chiave_uscita(host, uscita):
+    """Ritmo e circuit breaker valgono per coppia host + uscita: ogni proxy ha il suo budget."""
+    return host if not uscita or uscita == 'diretto' else f"{host}@{uscita}"
+
+def uscite_ferme(host):
+    """Uscite con il circuito aperto verso `host` e la pausa non ancora finita."""
+    adesso = time.monotonic()
+    ferme = []
+    for uscita in scraper.uscite():
+        controllore = _controllore_per_host.get(chiave_uscita(host, uscita))
+        if controllore and controllore.stato == 'aperto' and adesso < controllore.riapertura:
+            ferme.append(uscita)
+    return ferme
+
+def scegli_uscita(host):
+    """Uscita per la prossima richiesta a `host`: la più in salute con il circuito chiuso e un token già disponibile.
+
+    Così con N proxy le richieste si distribuiscono e il ritmo complessivo cresce con N.
+    """
+    ferme = uscite_ferme(host)
+    occupate = [
+        uscita for uscita in scraper.uscite()
+        if uscita not in ferme and bucket_per_host(chiave_uscita(host, uscita)).attesa_stimata() > 0
+    ]
+    if len(ferme) + len(occupate) < len(scraper.uscite()):
+        return scraper.scegli_uscita(escludi=ferme + occupate)
+    return scraper.scegli_uscita(escludi=ferme)
+
+def url_affiliato(url):
+    """(asin, link affiliato /dp/) di un link Amazon, o (None, None) se manca l'ASIN."""
     asin_match = re.search(r'(B0[A-Z0-9]{8})', url)
     if not asin_match:
-        print(f"⚠️ ASIN non trovato in {url}. Salto.")
         return None, None
-        
     asin = asin_match.group(1)
-    url_aff = f"https://www.amazon.it/dp/{asin}?tag={AMAZON_TAG}"
+    return asin, f"https://www.amazon.it/dp/{asin}?tag={AMAZON_TAG}"
+
+# --- FUNZIONE WEB SCRAPING GENTILE (VERS. DEFINITIVA) ---
+def get_product_data_gentle(url, uscita=None):
+    """Estrae titolo e prezzo corrente da un link Amazon con logica di fallback e OOS.
+
+    Non attende prima della richiesta: il ritmo lo decide il token bucket del motore concorrente.
+    """
+    
+    asin, url_aff = url_affiliato(url)
+    if not asin:
+        print(f"⚠️ ASIN non trovato in {url}. Salto.")
+        return None, None
     
     headers = {
         'User-Agent': random.choice([
@@ -132,71 +359,47 @@ def get_product_data_gentle(url):
         'Accept-Language': 'it-IT,it;q=0.9,en-US;q=0.8,en;q=0.7',
     }
     
+    controllore = controllore_per_host(chiave_uscita(urllib.parse.urlparse(url_aff).netloc, uscita))
     try:
-        # ⚠️ SCRAPING GENTILE: Ritardo casuale
-        sleep_time = random.uniform(5, 15) 
-        time.sleep(sleep_time)
-        
-        response = requests.get(url_aff, headers=headers, timeout=15)
+        response, contenuto, lettura = scraper.scarica_parziale(url_aff, headers=headers, timeout=15, uscita=uscita)
         
+        if response.status_code in (503, 429):
+            print(f"❌ Scraping fallito per {asin}: blocco Amazon (Status {response.status_code}).")
+            controllore.registra(ESITO_BLOCCO)
+            return None, None
+
         if response.status_code != 200:
             print(f"❌ Scraping fallito per {asin}: Status {response.status_code}. Riprova.")
+            controllore.registra(ESITO_ERRORE)
             return None, None
 
-        if "captcha" in response.text.lower() or response.status_code == 503:
-             print("❌ Scraping fallito: CAPTCHA o blocco Amazon (Status 503).")
-             # Se necessario, qui si può inserire la logica di pausa lunga (es. 1 ora)
+        if b"captcha" in contenuto.lower():
+             print(f"❌ Scraping fallito: CAPTCHA Amazon (uscita {response.uscita}).")
+             scraper.segnala_captcha(response)
+             controllore.registra(ESITO_BLOCCO)
              return None, None 
 
-        soup = BeautifulSoup(response.content, 'html.parser')
-        
-        # 1. ESTREZIONE TITOLO
-        title_tag = soup.find('span', id='productTitle')
-        title = title_tag.text.strip() if title_tag else "Titolo non trovato"
+        controllore.registra(ESITO_OK)
+        if lettura['interrotto']:
+            risparmiati = f"{lettura['byte_risparmiati'] // 1024} KB" if lettura['byte_risparmiati'] is not None else "lunghezza ignota"
+            print(f"📦 {asin}: letti {lettura['byte_letti'] // 1024} KB, risparmiati {risparmiati}.")
 
-        # 2. ESTREZIONE PREZZO (LOGICA AGGIORNATA)
-        price = None
-        
-        # Cerca 1: Prezzo principale (a-price con a-offscreen)
-        price_tag_offscreen = soup.find('span', class_='a-price')
-        if price_tag_offscreen:
-            price_text = price_tag_offscreen.find('span', class_='a-offscreen')
-            if price_text:
-                price = price_text.text.strip()
-        
-        # Fallback 1: Cerca il prezzo per offerte lampo/prezzo barrato
-        if not price:
-            price_tag_main = soup.find('span', id='priceblock_ourprice') or soup.find('span', id='priceblock_dealprice')
-            if price_tag_main:
-                price = price_tag_main.text.strip()
-        
-        # Fallback 2: Cerca il prezzo per le variazioni/core price feature
-        if not price:
-             price_tag_variation = soup.find('div', id='corePriceDisplay_desktop_feature_div')
-             if price_tag_variation:
-                 price_text = price_tag_variation.find('span', class_='a-offscreen')
-                 if price_text:
-                      price = price_text.text.strip()
-                      
-        # ⭐⭐ NUOVO FALLBACK 3: CERCA GENERICAMENTE a-offscreen (Ultima Risorsa) ⭐⭐
-        if not price:
-            all_offscreen = soup.find_all('span', class_='a-offscreen')
-            # Prendiamo il primo a-offscreen che contiene la valuta, spesso è il prezzo principale.
-            for tag in all_offscreen:
-                price_text = tag.text.strip()
-                if '€' in price_text or '$' in price_text:
-                    price = price_text
-                    break
+        # Estrazione condivisa con ProfitBot (catena di selettori in scraper.py)
+        dati_pagina = scraper.estrai_dati_prodotto(contenuto)
+        title = dati_pagina['titolo'] or "Titolo non trovato"
+        price = dati_pagina['prezzo']
+        availability_txt = dati_pagina['disponibilita']
         
         # 3. CONTROLLO OOS (Esaurimento Scorte)
-        oos_tag = soup.find('div', id='availability')
-        if oos_tag and ("non disponibile" in oos_tag.text.lower() or "currently unavailable" in oos_tag.text.lower()):
+        if availability_txt and ("non disponibile" in availability_txt.lower() or "currently unavailable" in availability_txt.lower()):
             print(f"⚠️ Prodotto {asin} Esaurito (OOS). Prezzo impostato a 0.0")
             cleaned_price = 0.0
         else:
             cleaned_price = clean_price_calc(price)
             
         if cleaned_price > 0.0:
+            if dati_pagina['titolo']:
+                scraper.scrivi_cache(asin, dati_pagina)
             return asin, {
                 'titolo': title,
                 'prezzo_nuovo': cleaned_price,
@@ -208,117 +411,566 @@ def get_product_data_gentle(url):
 
     except requests.exceptions.Timeout:
         print(f"❌ Timeout Scraping per {url_aff}.")
+        controllore.registra(ESITO_TIMEOUT)
         return None, None
     except Exception as e:
         handle_critical_error(e, f"SCRAPER: {url_aff}")
+        controllore.registra(ESITO_ERRORE)
         return None, None
 
 # --- FUNZIONE PRINCIPALE DEL CRUISER ---
-def run_cruiser():
-    
+def elabora_prodotto(asin, data_scraped, voce=None):
+    """Confronta il prezzo appena letto con l'indice e registra/notifica i ribassi. True se c'è stato un ribasso.
+
+    voce: opzioni della watchlist; 'soglia' (sconto minimo in %) e 'prezzo_max' filtrano i ribassi da registrare.
+    """
+    current_price = data_scraped['prezzo_nuovo']
+
+    # Se lo scraper ha trovato il prodotto ma il prezzo è 0 (OOS)
+    if current_price == 0.0:
+        return False
+
+    last_price_db, _ = get_last_price_from_db(asin)
+
+    if last_price_db == 0.0:
+         # Primo monitoraggio: usiamo il prezzo corrente come 'vecchio'
+         last_price_db = current_price
+
+    # --- LOGICA DI RILEVAMENTO RIBASSO ---
+
+    # Se il prezzo è sceso di almeno il 10% O è sceso sotto l'ultimo prezzo noto
+    is_significant_drop = last_price_db > 0 and (current_price / last_price_db) < 0.90
+    is_lower_than_last = current_price < last_price_db
+
+    if is_significant_drop or is_lower_than_last:
+
+        difference = last_price_db - current_price
+        perc_drop = int(100 - (current_price / last_price_db * 100)) if last_price_db > 0 else 0
+
+        if voce and voce['soglia'] is not None and 100 - (current_price / last_price_db * 100) < voce['soglia']:
+            print(f"🔽 Ribasso di {asin} (-{perc_drop}%) sotto la soglia del {voce['soglia']:g}%. Non registrato.")
+            return False
+        if voce and voce['prezzo_max'] is not None and current_price > voce['prezzo_max']:
+            print(f"🔽 Ribasso di {asin} a {format_price_for_excel(current_price)}€, sopra il prezzo massimo. Non registrato.")
+            return False
+
+        dati_salvataggio = {
+            'asin': asin,
+            'titolo': data_scraped['titolo'],
+            'old_price_db_save': format_price_for_excel(last_price_db),
+            'new_price_scraped_save': format_price_for_excel(current_price),
+            'link_aff': data_scraped['link_aff']
+        }
+
+        if salva_in_excel(dati_salvataggio, "CRUISER_RIBASSO"):
+
+            message_notify = (
+                f"🔔 **🚨 NUOVO RIBASSO AUTOMATICO RILEVATO!** 🚨\n\n"
+                f"**Prodotto:** {data_scraped['titolo']}\n"
+                f"**Prezzo Corrente:** `{format_price_for_excel(current_price)}€`\n"
+                f"**Prezzo Precedente (DB):** `{format_price_for_excel(last_price_db)}€`\n"
+                f"📉 **Sconto Rilevato:** -{perc_drop}% ({format_price_for_excel(difference)}€)\n\n"
+                f"👉 **PRONTO PER LA PUBBLICAZIONE:** Vai al menu `Inizia Nuovo Post` in ProfitBot.\n"
+                f"   Il prodotto è l'ultimo salvato nel tuo database."
+            )
+
+            try:
+                bot.send_message(FABRIZIO_CHAT_ID, message_notify, parse_mode='Markdown')
+            except Exception as e:
+                handle_critical_error(e, "TELEGRAM_NOTIFY")
+            return True
+
+        else:
+             print(f"❌ Errore salvataggio DB per {asin}.")
+
+    elif current_price > last_price_db and last_price_db > 0:
+        print(f"📈 Prezzo aumentato per {asin}. Non registrato.")
+        pass
+
+    else:
+         print(f"✅ Prodotto {asin} monitorato. Nessun cambiamento significativo.")
+    return False
+
+async def _controlla_url(url, semaforo):
+    asin, url_aff = url_affiliato(url)
+    if not asin:
+        print(f"⚠️ ASIN non trovato in {url}. Salto.")
+        return None, None
+    host = urllib.parse.urlparse(url_aff).netloc
+    async with semaforo:
+        uscita = scegli_uscita(host)
+        chiave = chiave_uscita(host, uscita)
+        await controllore_per_host(chiave).attendi()
+        await bucket_per_host(chiave).attendi()
+        return await asyncio.to_thread(get_product_data_gentle, url, uscita)
+
+class SchedulerAdattivo:
+    """Coda a priorità dei controlli, ordinata per istante del prossimo controllo.
+
+    La volatilità di ogni ASIN è una media mobile esponenziale dei cambi di prezzo osservati
+    (0 = mai cambia, 1 = cambia a ogni controllo) e sposta l'intervallo tra INTERVALLO_MAX e INTERVALLO_MIN.
+    """
+
+    def __init__(self, budget_ora=BUDGET_RICHIESTE_ORA):
+        self.budget_ora = budget_ora
+        self.stato = {}
+        self.fattore_carico = 1.0
+        self._coda = []
+
+    def sincronizza(self, voci):
+        """Allinea lo scheduler alla watchlist ({asin: voce}, vedi leggi_watchlist).
+
+        I nuovi ASIN vanno controllati subito; se cambia la priorità di un ASIN già noto
+        il suo prossimo controllo viene ricalcolato. Restituisce (aggiunti, rimossi).
+        """
+        adesso = time.time()
+        aggiunti = 0
+        for asin, voce in voci.items():
+            st = self.stato.get(asin)
+            if st is not None:
+                # voce None: ripreso dal checkpoint e non ancora in coda (entra adesso che ha un URL)
+                ripreso = st['voce'] is None
+                priorita_cambiata = not ripreso and st['voce']['priorita'] != voce['priorita']
+                st['url'] = voce['url']
+                st['voce'] = voce
+                if ripreso and st['prossimo'] is not None:
+                    heapq.heappush(self._coda, (st['prossimo'], asin))
+                elif priorita_cambiata and st['prossimo'] is not None and st['ultimo_controllo']:
+                    st['prossimo'] = st['ultimo_controllo'] + self._intervallo_base(st) * self.fattore_carico
+                    heapq.heappush(self._coda, (st['prossimo'], asin))
+                continue
+            self.stato[asin] = {
+                'url': voce['url'], 'voce': voce, 'volatilita': 0.5, 'controlli': 0, 'ultimo_prezzo': None,
+                'ultimo_ribasso': None, 'ultimo_controllo': None, 'prossimo': adesso
+            }
+            heapq.heappush(self._coda, (adesso, asin))
+            aggiunti += 1
+        rimossi = 0
+        for asin in list(self.stato):
+            if asin not in voci:
+                # Le sue voci nella coda verranno scartate all'estrazione
+                del self.stato[asin]
+                rimossi += 1
+        self._aggiorna_carico()
+        return aggiunti, rimossi
+
+    def _intervallo_base(self, st):
+        p = st['volatilita']
+        secondi = INTERVALLO_MAX ** (1 - p) * INTERVALLO_MIN ** p
+        if st['ultimo_ribasso'] and time.time() - st['ultimo_ribasso'] < 86400:
+            secondi /= 2
+        secondi = max(INTERVALLO_MIN, min(INTERVALLO_MAX, secondi))
+        # La priorità della watchlist si applica dopo i limiti: 'alta' può scendere sotto INTERVALLO_MIN
+        return secondi * PRIORITA[st['voce']['priorita']] if st['voce'] else secondi
+
+    def imposta_budget(self, budget_ora):
+        """Cambia il budget orario (es. quando cambiano i worker) e ricalcola il fattore di carico."""
+        if budget_ora != self.budget_ora:
+            self.budget_ora = budget_ora
+            self._aggiorna_carico()
+
+    def _aggiorna_carico(self):
+        domanda_ora = sum(3600 / self._intervallo_base(st) for st in self.stato.values())
+        self.fattore_carico = max(1.0, domanda_ora / self.budget_ora) if self.budget_ora > 0 else 1.0
+
+    def scaduti(self, limite):
+        """Estrae fino a `limite` ASIN il cui controllo è dovuto: [(asin, url)]."""
+        adesso = time.time()
+        pronti = []
+        while self._coda and len(pronti) < limite and self._coda[0][0] <= adesso:
+            prossimo, asin = heapq.heappop(self._coda)
+            st = self.stato.get(asin)
+            if st is None or st['prossimo'] != prossimo:
+                continue
+            st['prossimo'] = None  # in volo
+            pronti.append((asin, st['url']))
+        return pronti
+
+    def ripristina_in_volo(self):
+        """Rimette in coda, da controllare subito, gli ASIN rimasti 'in volo' (es. task cancellati da un errore del ciclo)."""
+        adesso = time.time()
+        ripresi = 0
+        for asin, st in self.stato.items():
+            if st['prossimo'] is None and st['voce'] is not None:
+                st['prossimo'] = adesso
+                heapq.heappush(self._coda, (adesso, asin))
+                ripresi += 1
+        return ripresi
+
+    def attesa(self):
+        """Secondi fino al prossimo controllo dovuto."""
+        while self._coda:
+            prossimo, asin = self._coda[0]
+            st = self.stato.get(asin)
+            if st is None or st['prossimo'] != prossimo:
+                heapq.heappop(self._coda)
+                continue
+            return max(0.0, prossimo - time.time())
+        return float(RISVEGLIO_SECONDI)
+
+    def registra_controllo(self, asin, prezzo, ribasso):
+        """Aggiorna la volatilità dell'ASIN con l'esito del controllo e lo rimette in coda."""
+        st = self.stato.get(asin)
+        if st is None:
+            return
+        adesso = time.time()
+        if prezzo:
+            cambiato = st['ultimo_prezzo'] is not None and prezzo != st['ultimo_prezzo']
+            st['volatilita'] = 0.8 * st['volatilita'] + 0.2 * (1.0 if cambiato else 0.0)
+            st['ultimo_prezzo'] = prezzo
+        if ribasso:
+            st['ultimo_ribasso'] = adesso
+        st['controlli'] += 1
+        st['ultimo_controllo'] = adesso
+        st['prossimo'] = adesso + self._intervallo_base(st) * self.fattore_carico
+        if st['voce'] is not None:
+            heapq.heappush(self._coda, (st['prossimo'], asin))
+        if st['controlli'] % 50 == 0:
+            self._aggiorna_carico()
+
+    def salva(self, percorso=CHECKPOINT_FILE):
+        """Scrive lo stato per ASIN su file temporaneo e rinomina: un crash non lascia mai un checkpoint a metà."""
+        adesso = time.time()
+        voci = {}
+        for asin, st in self.stato.items():
+            voce = {chiave: valore for chiave, valore in st.items() if chiave not in ('url', 'voce')}
+            if voce['prossimo'] is None:
+                voce['prossimo'] = adesso  # era in volo: va ricontrollato subito
+            voci[asin] = voce
+        tmp = percorso + ".tmp"
+        with open(tmp, 'w') as f:
+            json.dump({'salvato': adesso, 'asin': voci}, f)
+        os.replace(tmp, percorso)
+
+    def carica(self, percorso=CHECKPOINT_FILE):
+        """Riprende lo stato salvato. Gli ASIN scaduti durante il fermo vengono in coda dal più arretrato.
+
+        Il checkpoint non ha gli URL: gli ASIN entrano in coda solo al primo sincronizza() con la watchlist.
+        """
+        try:
+            with open(percorso, 'r') as f:
+                voci = json.load(f)['asin']
+        except FileNotFoundError:
+            return 0
+        except (ValueError, KeyError) as e:
+            print(f"⚠️ Checkpoint {percorso} illeggibile ({e}). Si riparte da zero.")
+            return 0
+        for asin, voce in voci.items():
+            st = {
+                'url': None, 'voce': None, 'volatilita': 0.5, 'controlli': 0, 'ultimo_prezzo': None,
+                'ultimo_ribasso': None, 'ultimo_controllo': None, 'prossimo': time.time()
+            }
+            st.update(voce)
+            self.stato[asin] = st
+        return len(voci)
+
+scheduler = SchedulerAdattivo()
+
+def analizza_riga_watchlist(riga):
+    """(asin, voce) da una riga della watchlist, o None se la riga è vuota, un commento o senza ASIN.
+
+    Formato: link Amazon (o ASIN) seguito da opzioni facoltative, es.
+    `https://www.amazon.it/gp/product/B0XXXXXXXX?ref=abc priorita=alta soglia=15 prezzo_max=29,90`
+    """
+    parti = riga.split('#', 1)[0].split()
+    if not parti:
+        return None
+    asin, url_aff = url_affiliato(parti[0])
+    if not asin:
+        print(f"⚠️ ASIN non trovato in {parti[0]}. Salto.")
+        return None
+    voce = {'url': url_aff, 'priorita': 'normale', 'soglia': None, 'prezzo_max': None}
+    for opzione in parti[1:]:
+        chiave, _, valore = opzione.partition('=')
+        try:
+            if chiave == 'priorita' and valore in PRIORITA:
+                voce['priorita'] = valore
+            elif chiave == 'soglia':
+                voce['soglia'] = float(valore.rstrip('%').replace(',', '.'))
+            elif chiave == 'prezzo_max':
+                voce['prezzo_max'] = float(valore.replace('€', '').replace(',', '.'))
+            else:
+                raise ValueError(opzione)
+        except ValueError:
+            print(f"⚠️ Opzione non valida per {asin}: {opzione}. Ignorata.")
+    return asin, voce
+
+def leggi_watchlist():
+    """{asin: voce} dalla watchlist, senza duplicati, o None se il file non esiste.
+
+    Link diversi dello stesso prodotto (/dp, /gp/product, parametri di tracciamento) diventano
+    un solo ASIN: vale la prima riga, le successive vengono segnalate e ignorate.
+    """
     try:
         with open(WATCHLIST_FILE, 'r') as f:
-            urls = [line.strip() for line in f if line.strip()]
+            righe = f.readlines()
+    except FileNotFoundError:
+        return None
+    voci = {}
+    for numero, riga in enumerate(righe, 1):
+        risultato = analizza_riga_watchlist(riga)
+        if risultato is None:
+            continue
+        asin, voce = risultato
+        if asin in voci:
+            print(f"⚠️ {asin} ripetuto alla riga {numero} di {WATCHLIST_FILE}. Ignorato.")
+            continue
+        voci[asin] = voce
+    return voci
+
+# Valore iniziale diverso da qualsiasi firma (anche None = file mancante): il primo controllo conta sempre come cambiamento
+_watchlist_firma = object()
+
+def watchlist_cambiata():
+    """True se watchlist.txt è cambiata (mtime o dimensione) dall'ultima chiamata. Sempre True alla prima."""
+    global _watchlist_firma
+    try:
+        st = os.stat(WATCHLIST_FILE)
+        firma = (st.st_mtime_ns, st.st_size)
     except FileNotFoundError:
-        print(f"❌ File {WATCHLIST_FILE} non trovato. Impossibile avviare il cruiser.")
+        firma = None
+    cambiata = firma != _watchlist_firma
+    _watchlist_firma = firma
+    return cambiata
+
+def stampa_statistiche(coordinatore=False):
+    print(f"📊 Scheduler: {len(scheduler.stato)} ASIN, fattore di carico {scheduler.fattore_carico:.2f}, "
+          f"prossimo controllo tra {scheduler.attesa():.0f}s")
+    if coordinatore:
+        coda = coda_lavori.statistiche()
+        print(f"📬 Coda lavori: {coda['in_attesa']} in attesa, {coda['in_corso']} in corso, "
+              f"{coda['risultati']} risultati da raccogliere, {coda['worker_attivi']} worker attivi")
         return
+    stampa_statistiche_scraping()
 
-    print(f"⏳ Inizio ciclo di monitoraggio su {len(urls)} prodotti...")
+def stampa_statistiche_scraping():
+    stats = scraper.statistiche_connessioni()
+    parsing = scraper.statistiche_parsing()
+    print(f"⏱️ Parsing: veloce {parsing['veloce']['pagine']} pagine ({parsing['veloce']['media_ms']} ms medi), "
+          f"BeautifulSoup {parsing['bs4']['pagine']} pagine ({parsing['bs4']['media_ms']} ms medi)")
+    selettori = scraper.statistiche_selettori()
+    print("🎯 Selettori prezzo: " + ", ".join(f"{nome} {st['successi']}/{st['tentativi']} ({st['hit_rate']}%)" for nome, st in selettori.items()))
+    if scraper.RIORDINA_CATENA:
+        print(f"🔀 Nuovo ordine catena prezzo: {scraper.riordina_catena()}")
+    print(f"🔌 Connessioni HTTP: {stats['richieste']} richieste, {stats['connessioni_aperte']} connessioni aperte, riuso {stats['percentuale_riuso']}%")
+    streaming = scraper.statistiche_streaming()
+    print(f"📦 Download: {streaming['download']} pagine, {streaming['interrotti']} interrotte in anticipo, "
+          f"{streaming['kb_letti']} KB letti, ~{streaming['kb_risparmiati']} KB risparmiati")
+    if len(scraper.uscite()) > 1:
+        for nome, st in scraper.statistiche_uscite().items():
+            print(f"🌐 Uscita {nome}: {st['richieste']} richieste, {st['blocchi']} blocchi, successo {st['successo']}, "
+                  f"latenza {st['latenza_ms']} ms, panchina {st['panchina_secondi']}s")
+    for host, controllore in _controllore_per_host.items():
+        print(f"🚦 {host}: circuito {controllore.stato}, ritmo {controllore.bucket.rate:.3f} req/s, "
+              f"aperture {controllore.aperture}, esiti {controllore.esiti}")
 
-    for url in urls:
-        asin, data_scraped = get_product_data_gentle(url)
-        
-        if not asin:
-            continue
+_ultima_manutenzione = {'ricarica': 0.0, 'checkpoint': time.time(), 'statistiche': time.time()}
 
-        current_price = data_scraped['prezzo_nuovo']
-        
-        # Se lo scraper ha trovato il prodotto ma il prezzo è 0 (OOS)
-        if current_price == 0.0:
-            continue
+def manutenzione_periodica(coordinatore=False):
+    """Ricarica la watchlist se è cambiata e, quando è ora, l'indice prezzi; salva il checkpoint, stampa le statistiche."""
+    ultima = _ultima_manutenzione
+    # La watchlist si rilegge appena cambia su disco: le modifiche valgono dal controllo successivo
+    if watchlist_cambiata():
+        voci = leggi_watchlist()
+        if voci is None:
+            print(f"❌ File {WATCHLIST_FILE} non trovato. Impossibile avviare il cruiser.")
+        else:
+            aggiunti, rimossi = scheduler.sincronizza(voci)
+            print(f"📋 Watchlist: {len(voci)} ASIN (+{aggiunti} / -{rimossi}).")
+    if time.time() - ultima['ricarica'] > RICARICA_INDICE_SECONDI:
+        aggiorna_indice_prezzi()
+        ultima['ricarica'] = time.time()
 
-        last_price_db, _ = get_last_price_from_db(asin)
-        
-        if last_price_db == 0.0:
-             # Primo monitoraggio: usiamo il prezzo corrente come 'vecchio'
-             last_price_db = current_price
-             
-        # --- LOGICA DI RILEVAMENTO RIBASSO ---
-        
-        # Se il prezzo è sceso di almeno il 10% O è sceso sotto l'ultimo prezzo noto
-        is_significant_drop = last_price_db > 0 and (current_price / last_price_db) < 0.90
-        is_lower_than_last = current_price < last_price_db
-        
-        if is_significant_drop or is_lower_than_last:
-            
-            difference = last_price_db - current_price
-            perc_drop = int(100 - (current_price / last_price_db * 100)) if last_price_db > 0 else 0
-            
-            dati_salvataggio = {
-                'asin': asin,
-                'titolo': data_scraped['titolo'],
-                'old_price_db_save': format_price_for_excel(last_price_db),
-                'new_price_scraped_save': format_price_for_excel(current_price),
-                'link_aff': data_scraped['link_aff']
-            }
-            
-            if salva_in_excel(dati_salvataggio, "CRUISER_RIBASSO"):
-                
-                message_notify = (
-                    f"🔔 **🚨 NUOVO RIBASSO AUTOMATICO RILEVATO!** 🚨\n\n"
-                    f"**Prodotto:** {data_scraped['titolo']}\n"
-                    f"**Prezzo Corrente:** `{format_price_for_excel(current_price)}€`\n"
-                    f"**Prezzo Precedente (DB):** `{format_price_for_excel(last_price_db)}€`\n"
-                    f"📉 **Sconto Rilevato:** -{perc_drop}% ({format_price_for_excel(difference)}€)\n\n"
-                    f"👉 **PRONTO PER LA PUBBLICAZIONE:** Vai al menu `Inizia Nuovo Post` in ProfitBot.\n"
-                    f"   Il prodotto è l'ultimo salvato nel tuo database."
-                )
-                
+    if time.time() - ultima['checkpoint'] > CHECKPOINT_OGNI_SECONDI:
+        try:
+            scheduler.salva()
+        except OSError as e:
+            print(f"⚠️ Checkpoint non salvato: {e}")
+        ultima['checkpoint'] = time.time()
+
+    if time.time() - ultima['statistiche'] > STATISTICHE_OGNI_SECONDI:
+        stampa_statistiche(coordinatore)
+        ultima['statistiche'] = time.time()
+
+def registra_esito(asin_controllato, asin, data_scraped):
+    """Elabora il risultato di un controllo (asin None = fallito) e rimette l'ASIN in coda nello scheduler."""
+    try:
+        voce = scheduler.stato[asin_controllato]['voce'] if asin_controllato in scheduler.stato else None
+        ribasso = elabora_prodotto(asin, data_scraped, voce) if asin else False
+        scheduler.registra_controllo(asin_controllato, data_scraped['prezzo_nuovo'] if asin else None, ribasso)
+    except Exception as e:
+        handle_critical_error(e, f"SCHEDULER: {asin_controllato}")
+        scheduler.registra_controllo(asin_controllato, None, False)
+
+async def esegui_scheduler():
+    """Lancia i controlli dovuti (al massimo CONCORRENZA_MAX in volo, nel budget per host) e li rimette in coda.
+
+    I risultati vengono elaborati nel thread dell'event loop man mano che arrivano,
+    quindi registro, indice prezzi e scheduler non sono mai toccati in parallelo.
+    """
+    semaforo = asyncio.Semaphore(CONCORRENZA_MAX)
+    in_volo = {}
+    # Dopo un errore del ciclo precedente i controlli in volo sono stati cancellati: tornano in coda
+    ripresi = scheduler.ripristina_in_volo()
+    if ripresi:
+        print(f"♻️ {ripresi} controlli interrotti rimessi in coda.")
+
+    while True:
+        manutenzione_periodica()
+
+        for asin, url in scheduler.scaduti(CONCORRENZA_MAX - len(in_volo)):
+            in_volo[asyncio.create_task(_controlla_url(url, semaforo))] = asin
+
+        # Con tutti i posti occupati gli ASIN scaduti restano nel heap (attesa 0): si aspetta un task finito, non il heap
+        attesa = RISVEGLIO_SECONDI if len(in_volo) >= CONCORRENZA_MAX else min(scheduler.attesa(), RISVEGLIO_SECONDI)
+        if in_volo:
+            completati, _ = await asyncio.wait(in_volo, timeout=attesa, return_when=asyncio.FIRST_COMPLETED)
+            for task in completati:
+                asin_controllato = in_volo.pop(task)
                 try:
-                    bot.send_message(FABRIZIO_CHAT_ID, message_notify, parse_mode='Markdown')
+                    asin, data_scraped = task.result()
                 except Exception as e:
-                    handle_critical_error(e, "TELEGRAM_NOTIFY")
-                
+                    handle_critical_error(e, f"SCHEDULER: {asin_controllato}")
+                    asin, data_scraped = None, None
+                registra_esito(asin_controllato, asin, data_scraped)
+        else:
+            await asyncio.sleep(attesa)
+
+def aggiorna_budget_coordinatore(worker_visti):
+    """Budget dello scheduler = budget di un processo × worker attivi.
+
+    Un worker è attivo se ha lavori in corso o ha consegnato un risultato nell'ultimo lease:
+    così un attimo di coda vuota non fa sembrare spariti i worker.
+    """
+    adesso = time.time()
+    for worker in [w for w, visto in worker_visti.items() if adesso - visto > coda_lavori.LEASE_SECONDI]:
+        del worker_visti[worker]
+    attivi = max(1, len(coda_lavori.worker_attivi() | set(worker_visti)))
+    budget = BUDGET_RICHIESTE_ORA * attivi
+    if budget != scheduler.budget_ora:
+        scheduler.imposta_budget(budget)
+        print(f"⚖️ Budget scheduler: {budget} richieste/ora ({attivi} worker), fattore di carico {scheduler.fattore_carico:.2f}.")
+
+def esegui_coordinatore():
+    """Mette in coda_lavori gli ASIN dovuti e registra i risultati che arrivano dai worker.
+
+    Ogni ASIN ha al massimo un lavoro aperto e torna nello scheduler solo quando arriva il suo
+    risultato, quindi nessun ASIN viene controllato due volte nello stesso intervallo.
+    """
+    worker_visti = {}
+    while True:
+        manutenzione_periodica(coordinatore=True)
+
+        posti = max(0, CODA_MAX_APERTI - len(coda_lavori.lavori_aperti()))
+        presi = scheduler.scaduti(posti)
+        for asin, url in presi:
+            # Se il lavoro è già in coda (es. da prima di un riavvio) si aspetta il suo risultato
+            coda_lavori.accoda(asin, url)
+
+        for asin, titolo, prezzo, link, worker in coda_lavori.raccogli_risultati():
+            worker_visti[worker] = time.time()
+            if asin not in scheduler.stato:
+                continue  # uscito dalla watchlist nel frattempo
+            if prezzo:
+                registra_esito(asin, asin, {'titolo': titolo, 'prezzo_nuovo': prezzo, 'link_aff': link})
             else:
-                 print(f"❌ Errore salvataggio DB per {asin}.")
+                registra_esito(asin, None, None)
 
-        elif current_price > last_price_db and last_price_db > 0:
-            print(f"📈 Prezzo aumentato per {asin}. Non registrato.")
-            pass
-            
+        aggiorna_budget_coordinatore(worker_visti)
+        # Coda piena: gli ASIN scaduti restano nel heap (attesa 0), si aspetta che i worker smaltiscano
+        coda_piena = len(presi) >= posti
+        time.sleep(RISVEGLIO_SECONDI if coda_piena else min(scheduler.attesa(), RISVEGLIO_SECONDI))
+
+def _circuito_bloccato(in_volo):
+    """Quanti lavori può prendere il worker visto lo stato dei circuit breaker: None = nessun limite.
+
+    Finché almeno un'uscita ha il circuito chiuso si lavora normalmente.
+    """
+    non_chiusi = [c for c in _controllore_per_host.values() if c.stato != 'chiuso']
+    if len(non_chiusi) < len(scraper.uscite()):
+        return None
+    adesso = time.monotonic()
+    if all(c.stato == 'aperto' and adesso < c.riapertura for c in non_chiusi):
+        return 0
+    return 0 if in_volo else 1  # una sola richiesta di prova
+
+async def esegui_worker():
+    """Prende lavori da coda_lavori, scarica le pagine e scrive i risultati per il coordinatore."""
+    worker = coda_lavori.id_worker()
+    semaforo = asyncio.Semaphore(CONCORRENZA_MAX)
+    in_volo = {}
+    ultime_statistiche = time.time()
+    print(f"👷 Worker {worker} avviato (concorrenza {CONCORRENZA_MAX}, coda {coda_lavori.CODA_FILE}).")
+
+    while True:
+        posti = CONCORRENZA_MAX - len(in_volo)
+        limite = _circuito_bloccato(in_volo)
+        if limite is not None:
+            # Con il circuito aperto non si prendono lavori: scadrebbe il lease mentre si aspetta
+            posti = min(posti, limite)
+        for asin, url in coda_lavori.prendi(worker, posti):
+            in_volo[asyncio.create_task(_controlla_url(url, semaforo))] = asin
+
+        if in_volo:
+            completati, _ = await asyncio.wait(in_volo, timeout=5, return_when=asyncio.FIRST_COMPLETED)
+            for task in completati:
+                asin_lavoro = in_volo.pop(task)
+                try:
+                    asin, data_scraped = task.result()
+                except Exception as e:
+                    handle_critical_error(e, f"WORKER: {asin_lavoro}")
+                    asin, data_scraped = None, None
+                if asin:
+                    consegnato = coda_lavori.completa(worker, asin_lavoro, data_scraped['titolo'], data_scraped['prezzo_nuovo'], data_scraped['link_aff'])
+                else:
+                    consegnato = coda_lavori.completa(worker, asin_lavoro)
+                if not consegnato:
+                    print(f"⚠️ Lease scaduto per {asin_lavoro}: risultato scartato.")
         else:
-             print(f"✅ Prodotto {asin} monitorato. Nessun cambiamento significativo.")
+            await asyncio.sleep(5)
+
+        if time.time() - ultime_statistiche > STATISTICHE_OGNI_SECONDI:
+            stampa_statistiche_scraping()
+            ultime_statistiche = time.time()
 
-    print("--- Ciclo completato. Riavvio in 5 minuti. ---")
-    time.sleep(300) 
+def run_cruiser(modalita="completo"):
+    """Avvia lo scheduler adattivo: gira finché non c'è un errore (lo stato resta in `scheduler`).
+
+    modalita: 'completo' (un processo fa tutto), 'coordinatore' o 'worker'.
+    """
+    if modalita == "worker":
+        asyncio.run(esegui_worker())
+        return
+    per_worker = " per worker" if modalita == "coordinatore" else ""
+    print(f"⏳ Avvio monitoraggio adattivo (budget {BUDGET_RICHIESTE_ORA} richieste/ora{per_worker}, "
+          f"intervalli {INTERVALLO_MIN}-{INTERVALLO_MAX}s)...")
+    if modalita == "coordinatore":
+        esegui_coordinatore()
+    else:
+        asyncio.run(esegui_scheduler())
 
 # --- MAIN LOOP PER IL CRUISER ---
 if __name__ == '__main__':
+    modalita = sys.argv[1] if len(sys.argv) > 1 else "completo"
     if not API_TOKEN or not FABRIZIO_CHAT_ID:
         print("❌ ERRORE: TELEGRAM_BOT_TOKEN o FABRIZIO_CHAT_ID mancante in .env. Impossibile avviare.")
+    elif modalita not in ("completo", "coordinatore", "worker"):
+        print(f"❌ Modalità sconosciuta: {modalita}. Uso: python cruiser.py [coordinatore|worker]")
     else:
+        if modalita != "worker":
+            # Il worker scarica soltanto: registro, indice prezzi e checkpoint sono del coordinatore
+            registro.inizializza_registro()
+            registro.avvia_compattazione()
+            carica_indice_prezzi()
+            ripresi = scheduler.carica()
+            if ripresi:
+                print(f"♻️ Ripreso il checkpoint di {ripresi} ASIN da {CHECKPOINT_FILE}.")
         while True:
             try:
-                # Controlla se Amazon ha bloccato prima di eseguire
-                if os.path.exists('PAUSE_CRUISER.flag'):
-                    print("Cruiser in pausa. Riprovo tra 1 minuto.")
-                    time.sleep(60)
-                    continue
-
-                run_cruiser()
-                
+                # I blocchi di Amazon sono gestiti dal circuit breaker: qui arrivano solo gli errori imprevisti
+                run_cruiser(modalita)
+
             except Exception as e:
-                # Se ricevi un blocco da Amazon (es. 503) e viene sollevata un'eccezione
-                if "BLOCCO AMAZON" in str(e) or "503" in str(e):
-                    # Crea un flag per mettere in pausa
-                    with open('PAUSE_CRUISER.flag', 'w') as f:
-                        f.write(datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
-                    bot.send_message(FABRIZIO_CHAT_ID, "⚠️ **BLOCCO AMAZON RILEVATO.** Il cruiser è in pausa per 1 ora.", parse_mode='Markdown')
-                    time.sleep(3600)
-                    # Qui dovresti implementare la logica per cambiare IP (se usi un proxy avanzato)
-                    os.remove('PAUSE_CRUISER.flag') # Rimuovi il flag e riprova
-                    
-                else:
-                    handle_critical_error(e, "MAIN_LOOP")
-                    print("❌ Errore nel loop principale. Riavvio in 30 secondi.")
-                    time.sleep(30)
\ No newline at end of file
+                handle_critical_error(e, "MAIN_LOOP")
+                print("❌ Errore nel loop principale. Riavvio in 30 secondi.")
+                time.sleep(30)
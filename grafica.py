@@ -0,0 +1,400 @@
+import io
+import os
+import hashlib
+import threading
+import functools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from PIL import Image, ImageDraw, ImageFont
+
+# --- RISORSE GRAFICHE (template e font) ---
+# Il template decodificato e i font per dimensione restano in memoria tra un post e l'altro:
+# si rileggono da disco solo se il file cambia (mtime/dimensione).
+TEMPLATE_FILE = "template.png"
+FONT_NAME = "Montserrat-Bold.ttf"
+FONT_RISERVA = "arial.ttf"
+
+# Cache su disco delle foto prodotto, per file_id Telegram: il collage del riassunto
+# non riscarica da Telegram le foto dei prodotti già pubblicati. Oltre CACHE_FOTO_MAX file
+# si eliminano quelli usati meno di recente.
+CACHE_FOTO_DIR = "cache_foto"
+CACHE_FOTO_MAX = int(os.getenv('GRAFICA_CACHE_FOTO_MAX', '200'))
+
+# Processi per il rendering dei post (0 = nel thread del bot, come prima). Ogni processo è una copia
+# del bot (fork): di default al massimo 2, bastano per qualche bozza in parallelo.
+PROCESSI_RENDER = int(os.getenv('GRAFICA_PROCESSI', str(min(2, os.cpu_count() or 1))))
+
+COLORE_SCONTO = (204, 0, 0)
+COLORE_PREZZO = (228, 121, 17)
+COLORE_VECCHIO = (120, 120, 120)
+COLORE_RISPARMIO = (34, 139, 34)
+MARGIN_RIGHT = 80
+
+_lock = threading.Lock()
+_template = {'firma': None, 'immagine': None}
+_font = {}
+_font_firma = {}
+_misure = {}
+MAX_MISURE = 4096
+
+
+def _firma(percorso):
+    """(mtime, dimensione) del file, o None se non esiste."""
+    try:
+        st = os.stat(percorso)
+        return (st.st_mtime_ns, st.st_size)
+    except FileNotFoundError:
+        return None
+
+
+def template_esiste():
+    return os.path.exists(TEMPLATE_FILE)
+
+
+def template():
+    """Copia del template già appiattito in RGB (come il JPEG finale): il file viene decodificato
+    e composto solo al primo uso o se cambia su disco.
+    """
+    firma = _firma(TEMPLATE_FILE)
+    with _lock:
+        if firma is None:
+            raise FileNotFoundError(TEMPLATE_FILE)
+        if _template['firma'] != firma:
+            with Image.open(TEMPLATE_FILE) as img:
+                # Un template con trasparenza diventa RGB come faceva la conversione finale a JPEG
+                _template['immagine'] = img.convert("RGBA").convert("RGB")
+            _template['firma'] = firma
+        # Chi disegna modifica l'immagine: la versione in cache resta intatta
+        return _template['immagine'].copy()
+
+
+def file_font():
+    """Font principale, o quello di riserva se Montserrat non c'è (come prima)."""
+    return FONT_NAME if os.path.exists(FONT_NAME) else FONT_RISERVA
+
+
+def font(dimensione, percorso=None):
+    """Font TrueType alla dimensione richiesta, caricato una sola volta per (file, dimensione).
+
+    Se il file cambia su disco le dimensioni già caricate vengono scartate; se non si può
+    caricare si usa il font di default di Pillow.
+    """
+    percorso = percorso or file_font()
+    firma = _firma(percorso)
+    with _lock:
+        if _font_firma.get(percorso) != firma:
+            for chiave in [chiave for chiave in _font if chiave[0] == percorso]:
+                del _font[chiave]
+            for chiave in [chiave for chiave in _misure if chiave[0] == percorso]:
+                del _misure[chiave]
+            _font_firma[percorso] = firma
+        chiave = (percorso, dimensione)
+        if chiave not in _font:
+            try:
+                _font[chiave] = ImageFont.truetype(percorso, dimensione)
+            except OSError:
+                _font[chiave] = ImageFont.load_default()
+        return _font[chiave]
+
+
+# --- IMPAGINAZIONE DEL TESTO ---
+# Le misure (textbbox) si calcolano una volta per (font, dimensione, testo): lo stesso prezzo
+# o lo stesso sconto in un altro post non si rimisura.
+_tela_misure = ImageDraw.Draw(Image.new("RGBA", (1, 1)))
+
+
+def impagina(testo, dimensione):
+    """Layout di `testo` alla dimensione data: {'testo', 'font', 'dimensione', 'bbox', 'larghezza', 'altezza'}."""
+    carattere = font(dimensione)
+    chiave = (file_font(), dimensione, testo)
+    with _lock:
+        bbox = _misure.get(chiave)
+    if bbox is None:
+        bbox = _tela_misure.textbbox((0, 0), testo, font=carattere)
+        with _lock:
+            if len(_misure) >= MAX_MISURE:
+                _misure.clear()
+            _misure[chiave] = bbox
+    return {
+        'testo': testo, 'font': carattere, 'dimensione': dimensione, 'bbox': bbox,
+        'larghezza': bbox[2] - bbox[0], 'altezza': bbox[3] - bbox[1],
+    }
+
+
+def adatta(testo, larghezza_max, massima=90, minima=40, passo=5):
+    """Layout alla dimensione più grande (da `massima` a `minima`, a passi di `passo`) con larghezza < larghezza_max.
+
+    La larghezza cresce con la dimensione, quindi basta una ricerca binaria: 3-4 misure invece di
+    provarle tutte. Se non entra neanche a `minima` si usa `minima`.
+    """
+    dimensioni = list(range(massima, minima - 1, -passo))
+    basso, alto = 0, len(dimensioni) - 1
+    while basso < alto:
+        medio = (basso + alto) // 2
+        if impagina(testo, dimensioni[medio])['larghezza'] < larghezza_max:
+            alto = medio
+        else:
+            basso = medio + 1
+    return impagina(testo, dimensioni[basso])
+
+
+# --- CACHE FOTO PER FILE_ID ---
+def _percorso_foto(file_id):
+    return os.path.join(CACHE_FOTO_DIR, hashlib.sha1(file_id.encode()).hexdigest() + ".jpg")
+
+
+def leggi_foto(file_id):
+    """Bytes della foto in cache per questo file_id, o None."""
+    percorso = _percorso_foto(file_id)
+    try:
+        with open(percorso, 'rb') as f:
+            dati = f.read()
+        os.utime(percorso)  # mtime = ultimo uso, per l'ordine LRU
+        return dati
+    except OSError:
+        return None
+
+
+def salva_foto(file_id, dati):
+    """Mette in cache la foto (scrittura atomica) e rispetta il limite di CACHE_FOTO_MAX file."""
+    try:
+        os.makedirs(CACHE_FOTO_DIR, exist_ok=True)
+        percorso = _percorso_foto(file_id)
+        tmp = f"{percorso}.{os.getpid()}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(dati)
+        os.replace(tmp, percorso)
+        _pulisci_cache_foto()
+    except OSError as e:
+        print(f"Errore scrittura cache foto: {e}")
+
+
+def _pulisci_cache_foto():
+    voci = [voce for voce in os.scandir(CACHE_FOTO_DIR) if voce.name.endswith(".jpg")]
+    if len(voci) <= CACHE_FOTO_MAX:
+        return
+    voci.sort(key=lambda voce: voce.stat().st_mtime)
+    for voce in voci[:len(voci) - CACHE_FOTO_MAX]:
+        try:
+            os.remove(voce.path)
+        except OSError:
+            pass
+
+
+# --- MASCHERE ---
+@functools.lru_cache(maxsize=64)
+def maschera_arrotondata(larghezza, altezza, raggio):
+    """Maschera L con angoli arrotondati, creata una volta per (larghezza, altezza, raggio). Da non modificare."""
+    mask = Image.new("L", (larghezza, altezza), 0)
+    ImageDraw.Draw(mask).rounded_rectangle((0, 0, larghezza, altezza), radius=raggio, fill=255)
+    return mask
+
+
+# --- DECODIFICA RIDOTTA ---
+def apri_ridotta(dati, minimo, modo="RGB"):
+    """Apre un'immagine da bytes. Se è un JPEG la decodifica già ridotta (draft: 1/2, 1/4, 1/8)
+    alla scala più piccola che resta almeno `minimo` (larghezza, altezza): il LANCZOS finale
+    lavora su meno pixel e non si alloca mai l'immagine intera.
+    """
+    img = Image.open(io.BytesIO(dati))
+    if img.format == 'JPEG':
+        img.draft('RGB', minimo)
+    return img.convert(modo)
+
+
+# --- RENDERING DEL POST ---
+def render_post(spec):
+    """JPEG (bytes) del post a partire da una specifica serializzabile.
+
+    spec: {'foto': bytes della foto prodotto, 'risparmio': testo in alto, 'sconto': testo sconto
+    ('' per non mostrarlo), 'prezzo_nuovo': es. '19,99€', 'prezzo_vecchio': testo barrato o None}.
+    """
+    tela = template()
+    W, H = tela.size
+
+    # Dimensioni finali calcolate sull'originale (basta leggere l'intestazione)
+    with Image.open(io.BytesIO(spec['foto'])) as originale:
+        larghezza, altezza = originale.size
+    target_w = int(W * 0.45)
+    target_h = int(H * 0.70)
+    ratio = min(target_w / larghezza, target_h / altezza)
+    new_w = int(larghezza * ratio)
+    new_h = int(altezza * ratio)
+    img_prod = apri_ridotta(spec['foto'], (new_w, new_h))
+    img_prod = img_prod.resize((new_w, new_h), Image.Resampling.LANCZOS)
+
+    # Foto incollata direttamente sul template RGB attraverso la maschera in cache
+    pos_x = 80
+    pos_y = (H - new_h) // 2 + 30
+    tela.paste(img_prod, (pos_x, pos_y), maschera_arrotondata(new_w, new_h, 40))
+
+    draw = ImageDraw.Draw(tela)
+
+    # 1. RISPARMIO IN ALTO
+    try:
+        risparmio = impagina(spec['risparmio'], 40)
+        draw.text(((W - risparmio['larghezza']) / 2, 75), spec['risparmio'], font=risparmio['font'], fill=COLORE_RISPARMIO)
+    except Exception:
+        pass
+
+    # 2. SCONTO
+    if spec['sconto']:
+        sconto = impagina(spec['sconto'], 85)
+        draw.text((W - sconto['larghezza'] - MARGIN_RIGHT, 380), spec['sconto'], font=sconto['font'], fill=COLORE_SCONTO)
+
+    # 3. PREZZO NUOVO (la dimensione più grande che entra tra la foto e il margine)
+    foto_end_x = pos_x + new_w + 30
+    text_end_x = W - MARGIN_RIGHT
+    prezzo = adatta(spec['prezzo_nuovo'], text_end_x - foto_end_x)
+    draw.text((text_end_x - prezzo['larghezza'], 490), spec['prezzo_nuovo'], font=prezzo['font'], fill=COLORE_PREZZO)
+
+    # 4. PREZZO VECCHIO (MATEMATICAMENTE CENTRATO)
+    if spec.get('prezzo_vecchio'):
+        vecchio = impagina(spec['prezzo_vecchio'], 55)
+        start_x_old = W - vecchio['larghezza'] - MARGIN_RIGHT
+        start_y_old = 610
+
+        draw.text((start_x_old, start_y_old), spec['prezzo_vecchio'], font=vecchio['font'], fill=COLORE_VECCHIO)
+
+        line_y = start_y_old + (vecchio['altezza'] / 2) + 12
+        draw.line((start_x_old, line_y, start_x_old + vecchio['larghezza'], line_y), fill=COLORE_VECCHIO, width=8)
+
+    bio = io.BytesIO()
+    tela.save(bio, 'JPEG', quality=95)
+    return bio.getvalue()
+
+
+# --- POOL DI PROCESSI PER IL RENDERING ---
+# Il rendering (decodifica, LANCZOS, JPEG) è tutto CPU: in un processo separato non blocca
+# il thread di polling di Telegram e più bozze preparate insieme usano più core.
+# Ogni processo ha la sua cache di template e font, preparata quando nasce.
+# Se un processo muore il pool non viene ricreato: un fork fatto adesso, con i thread del bot
+# già attivi, potrebbe ereditare un lock preso (es. _lock) e bloccarsi per sempre.
+_pool = None
+_pool_rotto = False
+DIMENSIONI_FONT = (40, 55, 85) + tuple(range(90, 39, -5))
+
+
+def _prepara_cache():
+    """Carica template e font usati da render_post (initializer dei processi del pool)."""
+    if not template_esiste():
+        return
+    try:
+        template()
+        for dimensione in DIMENSIONI_FONT:
+            font(dimensione)
+    except Exception as e:
+        print(f"⚠️ Cache grafica non preparata: {e}")
+
+
+def _pool_render():
+    global _pool
+    with _lock:
+        if _pool is None and PROCESSI_RENDER > 0 and not _pool_rotto:
+            # fork: i processi non rieseguono il modulo principale del bot (che all'import crea il bot Telegram)
+            contesto = multiprocessing.get_context('fork') if 'fork' in multiprocessing.get_all_start_methods() else None
+            _pool = ProcessPoolExecutor(max_workers=PROCESSI_RENDER, mp_context=contesto, initializer=_prepara_cache)
+        return _pool
+
+
+def avvia_render():
+    """Crea il pool e tutti i suoi processi: da chiamare all'avvio, prima dei thread del bot.
+
+    Template e font si caricano prima nel processo del bot, così i processi nati con fork li
+    ereditano già pronti. Un invio per processo li fa nascere tutti adesso, non più tardi da un bot multithread.
+    """
+    _prepara_cache()
+    pool = _pool_render()
+    if pool:
+        for futuro in [pool.submit(template_esiste) for _ in range(PROCESSI_RENDER)]:
+            futuro.result()
+
+
+def invia_render(spec):
+    """Mette in coda il rendering: restituisce un Future con i bytes JPEG (o None se il pool è disattivato)."""
+    pool = _pool_render()
+    return pool.submit(render_post, spec) if pool else None
+
+
+def _disattiva_pool():
+    global _pool, _pool_rotto
+    with _lock:
+        if _pool_rotto:
+            return
+        _pool_rotto = True
+        pool, _pool = _pool, None
+    if pool:
+        pool.shutdown(wait=False, cancel_futures=True)
+    print("⚠️ Un processo di rendering è terminato: da ora i post si disegnano nel processo del bot (riavvia il bot per ripristinare il pool).")
+
+
+def render(spec, timeout=60):
+    """Rendering del post nel pool di processi, con ripiego nel processo corrente se il pool non è disponibile."""
+    try:
+        futuro = invia_render(spec)
+        if futuro is not None:
+            return futuro.result(timeout=timeout)
+    except BrokenProcessPool:
+        _disattiva_pool()
+    return render_post(spec)
+
+
+# --- BENCHMARK DECODIFICA ---
+def _psnr(a, b):
+    """Rapporto segnale/rumore in dB tra due immagini delle stesse dimensioni (oltre 40 dB: differenze invisibili)."""
+    import math
+    from PIL import ImageChops, ImageStat
+    diff = ImageStat.Stat(ImageChops.difference(a.convert("RGB"), b.convert("RGB")))
+    mse = sum(diff.sum2) / (3 * a.width * a.height)
+    return 99.0 if mse == 0 else 10 * math.log10(255 ** 2 / mse)
+
+
+def benchmark_decodifica(foto, ripetizioni=10):
+    """Prima/dopo per una foto (bytes): decodifica completa + LANCZOS contro draft + LANCZOS.
+
+    Misura la foto del post (template da 1080 px) e una cella del collage a 3 colonne (256 px).
+    """
+    import time
+    from PIL import ImageOps
+    with Image.open(io.BytesIO(foto)) as originale:
+        larghezza, altezza = originale.size
+    ratio = min(486 / larghezza, 756 / altezza)
+    post = (int(larghezza * ratio), int(altezza * ratio))
+    cella = (256, 256)
+
+    casi = {
+        'post prima': lambda: Image.open(io.BytesIO(foto)).convert("RGBA").resize(post, Image.Resampling.LANCZOS),
+        'post dopo': lambda: apri_ridotta(foto, post, "RGBA").resize(post, Image.Resampling.LANCZOS),
+        'collage prima': lambda: ImageOps.fit(Image.open(io.BytesIO(foto)).convert("RGB"), cella, Image.Resampling.LANCZOS),
+        'collage dopo': lambda: ImageOps.fit(apri_ridotta(foto, cella), cella, Image.Resampling.LANCZOS),
+    }
+    risultati = {}
+    for nome, funzione in casi.items():
+        tempi = []
+        for _ in range(ripetizioni):
+            inizio = time.perf_counter()
+            immagine = funzione()
+            tempi.append(1000 * (time.perf_counter() - inizio))
+        risultati[nome] = (sorted(tempi)[len(tempi) // 2], immagine)
+
+    # Memoria: dimensione del buffer decodificato (la memoria di Pillow non è visibile a tracemalloc)
+    decodificata = apri_ridotta(foto, post)
+    byte_prima = larghezza * altezza * 4
+    byte_dopo = decodificata.width * decodificata.height * 4
+    print(f"📷 {larghezza}x{altezza}, post {post[0]}x{post[1]}: decodifica a {decodificata.width}x{decodificata.height}")
+    for caso in ('post', 'collage'):
+        prima, img_prima = risultati[f'{caso} prima']
+        dopo, img_dopo = risultati[f'{caso} dopo']
+        print(f"   {caso:<8} prima {prima:7.1f} ms   dopo {dopo:7.1f} ms   ({prima / dopo:.1f}x)   PSNR {_psnr(img_prima, img_dopo):.1f} dB")
+    print(f"   buffer decodificato: prima {byte_prima / 1e6:.1f} MB, dopo {byte_dopo / 1e6:.1f} MB")
+
+
+if __name__ == '__main__':
+    import sys
+    if len(sys.argv) > 2 and sys.argv[1] == "benchmark":
+        for percorso in sys.argv[2:]:
+            with open(percorso, 'rb') as f:
+                benchmark_decodifica(f.read())
+    else:
+        print("❌ Uso: python grafica.py benchmark <foto.jpg> [altre foto...]")
@@ -1,18 +1,20 @@
 import telebot
 from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton
 import time
-from PIL import Image, ImageDraw, ImageFont, ImageOps
+from PIL import Image, ImageDraw, ImageOps
 import os
 import io
 import re
 import google.generativeai as genai
 from datetime import datetime
 import urllib.parse 
-from openpyxl import Workbook, load_workbook
 from dotenv import load_dotenv
 import requests 
-from bs4 import BeautifulSoup 
 import traceback 
+from concurrent.futures import ThreadPoolExecutor
+import registro
+import scraper
+import grafica
 
 # Carica tutte le variabili dal file .env (deve essere la prima cosa)
 load_dotenv()
@@ -28,8 +30,7 @@ CHANNEL_ID = '@citazioneradar'
 FABRIZIO_CHAT_ID = os.getenv('FABRIZIO_CHAT_ID') 
 
 AMAZON_TAG = 'radartest-21' 
-DB_FILE = "Registro_Vendite.xlsx"
-FONT_NAME = "Montserrat-Bold.ttf"
+FONT_NAME = grafica.FONT_NAME
 
 # Link Disclaimer
 LINK_INFO_POST = "https://t.me/citazioneradar/178" 
@@ -96,55 +97,34 @@ def handle_critical_error(e):
             print(f"Impossibile inviare la notifica a {FABRIZIO_CHAT_ID}: {notify_e}")
     print(message) 
 
-# --- DATABASE (Invariato nella logica) ---
+# --- DATABASE (Registro SQLite indicizzato, vedi registro.py) ---
 def inizializza_db():
-    if not os.path.exists(DB_FILE):
-        try:
-            wb = Workbook()
-            ws = wb.active
-            ws.title = "Vendite"
-            ws.append(["DATA", "ORA", "ASIN", "TITOLO", "PREZZO VECCHIO", "PREZZO NUOVO", "LINK", "FILE_ID"]) 
-            ws.column_dimensions['D'].width = 50
-            wb.save(DB_FILE)
-        except Exception as e: 
-            print(f"Errore inizializzazione DB: {e}")
+    try:
+        registro.inizializza_registro()
+        registro.avvia_compattazione()
+    except Exception as e: 
+        print(f"Errore inizializzazione DB: {e}")
 
 def is_gia_pubblicato(asin):
-    if not os.path.exists(DB_FILE): return False
+    if asin == "NO_ASIN": return False
     try:
-        wb = load_workbook(DB_FILE)
-        ws = wb.active
-        for row in ws.iter_rows(min_row=2, values_only=True):
-            if row[2] and asin in str(row[2]) and asin != "NO_ASIN":
-                return True
+        return registro.esiste_asin(asin)
     except:
         return False
-    return False
 
 def salva_in_excel(dati):
-    adesso = datetime.now()
     try:
-        if os.path.exists(DB_FILE):
-            wb = load_workbook(DB_FILE)
-            ws = wb.active
-        else:
-            wb = Workbook()
-            ws = wb.active
-        
-        ws.append([
-            adesso.strftime("%d/%m/%Y"), 
-            adesso.strftime("%H:%M:%S"), 
+        registro.registra_vendita(
             dati.get('asin', 'N/A'), 
             dati.get('titolo', 'Nessun Titolo'), 
             dati.get('old_fmt_save', '0,00'),   
             dati.get('new_fmt_save', '0,00'),   
             dati.get('link', ''),
             dati.get('file_id', 'N/A') 
-        ])
-        wb.save(DB_FILE)
+        )
         return True
     except Exception as e:
-        print(f"Errore salvataggio Excel: {e}")
+        print(f"Errore salvataggio registro: {e}")
         return False
 
 # --- CLEANER E UTILITY (Invariato) ---
@@ -153,19 +133,8 @@ def clean_input_price(text):
     return text
 
 def clean_price_calc(price_str):
-    if not isinstance(price_str, str):
-        return 0.0
-    price_str = price_str.replace('€', '').replace('$', '').strip()
-    if price_str.count(',') == 1 and price_str.count('.') <= 1 and price_str.rfind(',') > price_str.rfind('.'):
-        price_str = price_str.replace('.', '')
-        price_str = price_str.replace(',', '.')
-    else:
-        price_str = price_str.replace(',', '') 
-        
-    try:
-        return float(price_str)
-    except ValueError:
-        return 0.0 
+    # Stesso parser del registro (riassunto giornaliero): un solo posto da correggere
+    return registro.valore_prezzo(price_str)
         
 def format_price_euro(val_float):
     return "{:,.2f}".format(val_float).replace(",", "X").replace(".", ",").replace("X", ".")
@@ -256,32 +225,32 @@ def get_product_data(url):
         'Accept-Language': 'it-IT,it;q=0.9,en-US;q=0.8,en;q=0.7',
     }
     
+    asin_match = re.search(r'(B0[A-Z0-9]{8})', url)
+    asin = asin_match.group(1) if asin_match else None
+    
     try:
-        response = requests.get(url, headers=headers, timeout=10)
-        
-        if response.status_code == 503 or "captcha" in response.text.lower():
-             print("❌ Scraping fallito: CAPTCHA o blocco di Amazon (Status 503).")
-             return None
+        # Prodotto letto di recente (es. ribasso segnalato dal Cruiser): nessuna nuova richiesta ad Amazon
+        dati_pagina = scraper.leggi_cache(asin) if asin else None
+        da_cache = dati_pagina is not None
+        if da_cache:
+            print(f"⚡ {asin} dalla cache pagine (letto {dati_pagina['eta']:.0f}s fa).")
+        else:
+            response, contenuto, lettura = scraper.scarica_parziale(url, headers=headers, timeout=10)
+            
+            if response.status_code == 503 or b"captcha" in contenuto.lower():
+                 print("❌ Scraping fallito: CAPTCHA o blocco di Amazon (Status 503).")
+                 scraper.segnala_captcha(response)
+                 return None
 
-        soup = BeautifulSoup(response.content, 'html.parser')
-        
-        # 1. ESTREZIONE TITOLO
-        title_tag = soup.find('span', id='productTitle')
-        title = title_tag.text.strip() if title_tag else None
+            # Estrazione condivisa con il Cruiser (catena di selettori in scraper.py)
+            dati_pagina = scraper.estrai_dati_prodotto(contenuto)
+            print(f"⏱️ Parsing pagina ({dati_pagina['percorso']}, selettore {dati_pagina['selettore']}): {dati_pagina['tempo_parsing'] * 1000:.1f} ms")
+            if lettura['interrotto']:
+                risparmiati = f"{lettura['byte_risparmiati'] // 1024} KB" if lettura['byte_risparmiati'] is not None else "lunghezza ignota"
+                print(f"📦 Download interrotto in anticipo: letti {lettura['byte_letti'] // 1024} KB, risparmiati {risparmiati}.")
 
-        # 2. ESTREZIONE PREZZO (Targeting multipli ID/classi per robustezza)
-        price = None
-        
-        price_tag_main = soup.find('span', class_='a-price aok-align-center') 
-        if price_tag_main:
-            price_text = price_tag_main.find('span', class_='a-offscreen')
-            if price_text:
-                price = price_text.text.strip()
-        
-        if not price:
-            price_tag_lampo = soup.find('span', id='priceblock_ourprice') or soup.find('span', id='priceblock_dealprice')
-            if price_tag_lampo:
-                price = price_tag_lampo.text.strip()
+        title = dati_pagina['titolo']
+        price = dati_pagina['prezzo']
 
         # Pulizia e conversione prezzo
         cleaned_price = 0.0
@@ -292,6 +261,8 @@ def get_product_data(url):
                 
         # 3. RITORNO DATI
         if title and cleaned_price > 0.0:
+            if asin and not da_cache:
+                scraper.scrivi_cache(asin, dati_pagina)
             return {
                 'titolo_estratto': rewrite_with_ai(title), 
                 'prezzo_nuovo_estratto': cleaned_price 
@@ -310,51 +281,26 @@ def get_product_data(url):
 
 # --- FUNZIONI DI RIASSUNTO E COLLAGE ---
 def get_riassunto_offerte():
-    if not os.path.exists(DB_FILE):
-        return "⚠️ Nessun record di offerte trovate nel database."
-
     adesso = datetime.now()
     oggi_str = adesso.strftime("%d/%m/%Y")
     riepilogo = f"👀 *Ecco il riassunto delle migliori offerte di oggi!* \n\n" 
     
-    record_oggi = {}
-    
     try:
-        # ... (omissis, la logica di caricamento DB è invariata)
-
-        wb = load_workbook(DB_FILE)
-        ws = wb.active
-        
-        for row in ws.iter_rows(min_row=2, values_only=True):
-            data_db = row[0]
-            prezzo_vecchio_str = row[4] 
-            prezzo_nuovo_str = row[5]
-
-            old_val = clean_price_calc(prezzo_vecchio_str)
-            new_val = clean_price_calc(prezzo_nuovo_str)
+        # Riassunto materializzato in registro.py: già ordinato per sconto e limitato ai primi 5
+        offerte_ordinate = registro.migliori_offerte_del_giorno(oggi_str, 5)
 
-            if str(data_db) == oggi_str and row[2] != 'N/A' and old_val > new_val and old_val > 0:
-                perc = int(100 - (new_val / old_val * 100))
-                old_fmt = format_price_euro(old_val) + "€"
-                new_fmt = format_price_euro(new_val) + "€"
-                
-                record_oggi[row[2]] = {
-                    'titolo': row[3],
-                    'prezzo_vecchio_fmt': old_fmt,
-                    'prezzo_nuovo_fmt': new_fmt,
-                    'link': row[6],
-                    'sconto_perc': perc 
-                }
-
-        num_offerte = len(record_oggi)
+        num_offerte = len(offerte_ordinate)
         if num_offerte == 0:
             return "⚠️ Nessuna offerta di ribasso trovata oggi nel database."
             
-        offerte_ordinate = sorted(record_oggi.items(), key=lambda item: item[1]['sconto_perc'], reverse=True)
-            
-        count = 0 
-        for asin, dati in offerte_ordinate:
-            if count >= 5: break
+        for asin, titolo, old_val, new_val, link, perc in offerte_ordinate:
+            dati = {
+                'titolo': titolo,
+                'prezzo_vecchio_fmt': format_price_euro(old_val) + "€",
+                'prezzo_nuovo_fmt': format_price_euro(new_val) + "€",
+                'link': link,
+                'sconto_perc': perc 
+            }
             titolo_pulito = dati['titolo'].split('(')[0].strip()
             
             # Applichiamo escape_markdown SOLO al titolo, non al link.
@@ -374,7 +320,6 @@ def get_riassunto_offerte():
             # 💡 CORREZIONE LINK: Usiamo la sintassi [Testo](URL) in Markdown.
             # L'URL (short_link) NON DEVE essere escaped.
             riepilogo += f"🔍 [Link Prodotto]({short_link})\n\n" 
-            count += 1
             
         riepilogo += "🔗 *Tutti i link sono affiliati.*\n"
         
@@ -390,18 +335,12 @@ def get_riassunto_offerte():
         return f"❌ Errore nella lettura DB: {e}"
 
 def get_latest_image_ids():
-    if not os.path.exists(DB_FILE): return []
     file_ids = []
     adesso = datetime.now()
     oggi_str = adesso.strftime("%d/%m/%Y")
-    ws = None
     
     try:
-        wb = load_workbook(DB_FILE)
-        ws = wb.active
-        if ws.max_row < 2: return []
-            
-        for row in reversed(list(ws.iter_rows(min_row=2, values_only=True))):
+        for row in reversed(registro.vendite_del_giorno(oggi_str)):
             data_db = row[0]
             file_id = row[7] 
             prezzo_vecchio_str = row[4]
@@ -423,16 +362,22 @@ def get_latest_image_ids():
         print(f"Errore lettura file IDs: {e}") 
         return []
 
+def scarica_foto(file_id):
+    """Bytes della foto Telegram: dalla cache locale se c'è, altrimenti scaricata e messa in cache."""
+    foto = grafica.leggi_foto(file_id)
+    if foto is None:
+        file_info = bot.get_file(file_id)
+        foto = bot.download_file(file_info.file_path)
+        grafica.salva_foto(file_id, foto)
+    return foto
+
 def crea_collage_riassunto():
     file_ids = get_latest_image_ids()
     
     if not file_ids:
         img = Image.new('RGB', (600, 600), color = 'gray')
         draw = ImageDraw.Draw(img)
-        try:
-            font = ImageFont.truetype(FONT_NAME, 40)
-        except:
-            font = ImageFont.load_default()
+        font = grafica.font(40, FONT_NAME)
             
         draw.text((50, 280), "⚠️ NESSUNA FOTO DI RIBASSO TROVATA OGGI ⚠️", fill=(255, 255, 255), font=font)
         bio = io.BytesIO()
@@ -442,12 +387,15 @@ def crea_collage_riassunto():
         
     immagini_collage = []
     
-    for file_id in file_ids:
+    # Download in parallelo (solo per le foto che non sono già nella cache locale), nell'ordine dei file_id
+    with ThreadPoolExecutor(max_workers=len(file_ids)) as pool:
+        futuri = [(file_id, pool.submit(scarica_foto, file_id)) for file_id in file_ids]
+    for file_id, futuro in futuri:
         try:
-            file_info = bot.get_file(file_id)
-            downloaded_file = bot.download_file(file_info.file_path)
-            img = Image.open(io.BytesIO(downloaded_file)).convert("RGB")
-            immagini_collage.append(img)
+            downloaded_file = futuro.result()
+            # Solo l'intestazione: la decodifica (ridotta) si fa quando si conosce la dimensione della cella
+            Image.open(io.BytesIO(downloaded_file)).verify()
+            immagini_collage.append(downloaded_file)
         except Exception as e:
             print(f"Errore download foto {file_id}: {e}")
             continue
@@ -455,10 +403,7 @@ def crea_collage_riassunto():
     if not immagini_collage:
         img = Image.new('RGB', (600, 600), color = 'gray')
         draw = ImageDraw.Draw(img)
-        try:
-            font = ImageFont.truetype(FONT_NAME, 40)
-        except:
-            font = ImageFont.load_default()
+        font = grafica.font(40, FONT_NAME)
             
         draw.text((50, 280), "⚠️ FALLBACK: ERRORE SCARICAMENTO FOTO ⚠️", fill=(255, 255, 255), font=font)
         bio = io.BytesIO()
@@ -490,12 +435,18 @@ def crea_collage_riassunto():
     
     collage = Image.new('RGB', (larghezza_finale, altezza_finale), color='white')
     
-    for i, img in enumerate(immagini_collage):
+    for i, foto in enumerate(immagini_collage):
         
         row = i // cols
         col = i % cols
         
-        img_resized = ImageOps.fit(img, (dim_cella_effettiva - PADDING, dim_cella_effettiva - PADDING), Image.Resampling.LANCZOS)
+        lato_cella = dim_cella_effettiva - PADDING
+        try:
+            img = grafica.apri_ridotta(foto, (lato_cella, lato_cella))
+        except Exception as e:
+            print(f"Errore decodifica foto del collage: {e}")
+            continue
+        img_resized = ImageOps.fit(img, (lato_cella, lato_cella), Image.Resampling.LANCZOS)
         x_offset = col * dim_cella_effettiva + PADDING // 2
         y_offset = row * dim_cella_effettiva + PADDING // 2
         
@@ -522,6 +473,8 @@ def crea_collage_riassunto():
 def show_riassunto(chat_id, call):
     """Genera il riassunto testuale e chiede conferma per il collage."""
     riepilogo_txt = get_riassunto_offerte()
+    # Riutilizzato da pubblica_riassunto_handler: stesso testo mostrato in anteprima, nessun ricalcolo
+    user_data.setdefault(chat_id, {})['riassunto_txt'] = riepilogo_txt
     
     markup = InlineKeyboardMarkup(row_width=1)
     markup.add(InlineKeyboardButton("📸 Crea Collage e Pubblica", callback_data="pubblica_riassunto"))
@@ -539,7 +492,7 @@ def pubblica_riassunto_handler(chat_id, call):
     """Invia il collage al canale di test (chat_id) e chiede la conferma di pubblicazione."""
     try:
         collage_bytes = crea_collage_riassunto()
-        riepilogo_txt = get_riassunto_offerte() 
+        riepilogo_txt = user_data.get(chat_id, {}).pop('riassunto_txt', None) or get_riassunto_offerte() 
         
         markup_confirm = InlineKeyboardMarkup(row_width=1)
         markup_confirm.add(InlineKeyboardButton("✅ CONFERMA PUBBLICAZIONE", callback_data="confirma_pubblica_riassunto"))
@@ -780,6 +733,9 @@ def callback_handler(call):
                 photo_file = io.BytesIO(dati['img_bytes'])
                 bot.send_photo(CHANNEL_ID, photo_file, caption=dati['caption'], reply_markup=dati['markup'], parse_mode='Markdown')
                 salva_in_excel(dati)
+                # La foto è già in memoria: in cache subito, così il collage del riassunto non la riscarica
+                if dati.get('foto_bytes') and dati.get('file_id'):
+                    grafica.salva_foto(dati['file_id'], dati['foto_bytes'])
                 
                 msg = "✅ **PUBBLICATO!**"
                 # Modifichiamo il messaggio di conferma (il testo)
@@ -966,7 +922,7 @@ def step_foto_process(message):
 
     msg_wait = bot.send_message(message.chat.id, "🎨 **Grafica...**")
     
-    if not os.path.exists("template.png"):
+    if not grafica.template_esiste():
         bot.send_message(message.chat.id, "❌ Manca template.png")
         return
 
@@ -974,124 +930,43 @@ def step_foto_process(message):
     downloaded_file = bot.download_file(file_info.file_path)
     
     try:
-        img_prod = Image.open(io.BytesIO(downloaded_file)).convert("RGBA")
-        template = Image.open("template.png").convert("RGBA")
-        W, H = template.size 
-        
-        target_w = int(W * 0.45) 
-        target_h = int(H * 0.70)
-        ratio = min(target_w / img_prod.width, target_h / img_prod.height)
-        new_w = int(img_prod.width * ratio)
-        new_h = int(img_prod.height * ratio)
-        img_prod = img_prod.resize((new_w, new_h), Image.Resampling.LANCZOS)
-        
-        mask = Image.new("L", (new_w, new_h), 0)
-        draw_mask = ImageDraw.Draw(mask)
-        draw_mask.rounded_rectangle((0, 0, new_w, new_h), radius=40, fill=255)
-        img_rounded = Image.new("RGBA", (new_w, new_h), (0,0,0,0))
-        img_rounded.paste(img_prod, (0,0), mask)
-        img_prod = img_rounded
-
-        pos_x = 80 
-        pos_y = (H - new_h) // 2 + 30
-        template.paste(img_prod, (pos_x, pos_y), img_prod)
-
-        draw = ImageDraw.Draw(template)
-        
-        try:
-            font_main = FONT_NAME if os.path.exists(FONT_NAME) else "arial.ttf"
-            font_price = ImageFont.truetype(font_main, 90)
-            font_disc = ImageFont.truetype(font_main, 85)
-            font_small = ImageFont.truetype(font_main, 55)
-            font_brand = ImageFont.truetype(font_main, 40)
-        except:
-            font_price = ImageFont.load_default()
-            font_small = ImageFont.load_default()
-            font_disc = ImageFont.load_default()
-            font_brand = ImageFont.load_default()
-
         dati = user_data[message.chat.id]
         extras = dati.get('extras', {})
-        COLORE_SCONTO = (204, 0, 0)
-        COLORE_PREZZO = (228, 121, 17) 
-        COLORE_VECCHIO = (120, 120, 120)
-        COLORE_RISPARMIO = (34, 139, 34)
-        MARGIN_RIGHT = 80 
 
         # 1. RISPARMIO IN ALTO
         risparmio_txt = dati['risparmio']
         if extras.get('coupon'):
              risparmio_txt = "COUPON DISPONIBILE"
-             
-        try:
-            bbox_r = draw.textbbox((0, 0), risparmio_txt, font=font_brand)
-            w_r = bbox_r[2] - bbox_r[0]
-            x_r = (W - w_r) / 2
-            draw.text((x_r, 75), risparmio_txt, font=font_brand, fill=COLORE_RISPARMIO)
-        except: pass
 
         # 2. SCONTO
         testo_sconto = dati['sconto']
         
         if testo_sconto == "COUPON_MODE":
              testo_sconto = extras.get('coupon', 'NOVITÀ')
-        elif testo_sconto == "N/D":
+        elif testo_sconto == "N/D" or testo_sconto == "AUMENTO":
              testo_sconto = "" 
-        
-        if testo_sconto and testo_sconto != "AUMENTO": 
-            disc_bbox = draw.textbbox((0, 0), testo_sconto, font=font_disc)
-            disc_w = disc_bbox[2] - disc_bbox[0]
-            draw.text((W - disc_w - MARGIN_RIGHT, 380), testo_sconto, font=font_disc, fill=COLORE_SCONTO)
 
-        # --- 3. PREZZO NUOVO (AUTO-RESIZE) ---
+        # 3. PREZZO NUOVO
         val_new_str = format_price_euro(dati['new']) + "€"
         dati['new_fmt'] = val_new_str 
         dati['new_fmt_save'] = format_price_for_excel(dati['new']) 
 
-        current_font_size = 90
-        foto_end_x = pos_x + new_w + 30
-        text_end_x = W - MARGIN_RIGHT
-        max_available_width = text_end_x - foto_end_x
-
-        while True:
-            font_price = ImageFont.truetype(font_main, current_font_size)
-            price_bbox = draw.textbbox((0, 0), val_new_str, font=font_price)
-            price_width = price_bbox[2] - price_bbox[0]
-            
-            if price_width < max_available_width:
-                break
-            
-            current_font_size -= 5
-            if current_font_size < 40: break 
-
-        draw.text((text_end_x - price_width, 490), val_new_str, font=font_price, fill=COLORE_PREZZO)
-        
-        # 4. PREZZO VECCHIO (MATEMATICAMENTE CENTRATO)
+        # 4. PREZZO VECCHIO (barrato solo se diverso dal nuovo)
+        val_old_str = None
         if dati['old'] > 0 and dati['old'] != dati['new']:
             val_old_str = format_price_euro(dati['old']) + "€"
             dati['old_fmt'] = val_old_str
-            dati['old_fmt_save'] = format_price_for_excel(dati['old']) 
-            
-            old_bbox = draw.textbbox((0, 0), val_old_str, font=font_small)
-            old_width = old_bbox[2] - old_bbox[0]
-            old_height = old_bbox[3] - old_bbox[1]
-            
-            start_x_old = W - old_width - MARGIN_RIGHT
-            start_y_old = 610
-            
-            draw.text((start_x_old, start_y_old), val_old_str, font=font_small, fill=COLORE_VECCHIO)
-            
-            line_y = start_y_old + (old_height / 2) + 12 
-            draw.line((start_x_old, line_y, start_x_old + old_width, line_y), fill=COLORE_VECCHIO, width=8)
-        else:
-            dati['old_fmt_save'] = format_price_for_excel(dati['old'])
-            dati['new_fmt_save'] = format_price_for_excel(dati['new'])
-
-
-        bio = io.BytesIO()
-        template = template.convert("RGB")
-        template.save(bio, 'JPEG', quality=95)
-        bio.seek(0)
+        dati['old_fmt_save'] = format_price_for_excel(dati['old'])
+
+        # La grafica si compone in un processo separato (grafica.py): il polling di Telegram resta libero
+        jpeg = grafica.render({
+            'foto': downloaded_file,
+            'risparmio': risparmio_txt,
+            'sconto': testo_sconto,
+            'prezzo_nuovo': val_new_str,
+            'prezzo_vecchio': val_old_str,
+        })
+        bio = io.BytesIO(jpeg)
         bot.delete_message(message.chat.id, msg_wait.message_id)
         
         # --- CAPTION ---
@@ -1140,6 +1015,7 @@ def step_foto_process(message):
         markup.add(InlineKeyboardButton("😏 Invita un amico", url=share_url))
         
         user_data[message.chat.id]['file_id'] = message.photo[-1].file_id 
+        user_data[message.chat.id]['foto_bytes'] = downloaded_file
         user_data[message.chat.id]['img_bytes'] = bio.getvalue()
         user_data[message.chat.id]['caption'] = caption
         user_data[message.chat.id]['markup'] = markup
@@ -1340,6 +1216,8 @@ def step_update_discount(chat_id):
 
 # --- MAIN LOOP CORRETTO ---
 if __name__ == '__main__':
+    # I processi di rendering si creano prima che partano i thread (compattazione, polling)
+    grafica.avvia_render()
     inizializza_db()
     
     # Loop infinito con gestione degli errori critici
@@ -0,0 +1,574 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# --- CONFIGURAZIONE REGISTRO ---
+# Il registro vero e proprio è un database SQLite con indici su ASIN e data.
+# Registro_Vendite.xlsx resta disponibile come esportazione (vedi esporta_xlsx).
+DB_FILE = "Registro_Vendite.xlsx"
+DB_SQLITE = "Registro_Vendite.sqlite"
+# Journal append-only (una riga JSON per record): è il percorso di scrittura verso l'xlsx,
+# che viene aggiornato a blocchi dalla compattazione in background.
+JOURNAL_FILE = "Registro_Vendite.journal.jsonl"
+COMPATTAZIONE_SECONDI = int(os.getenv('REGISTRO_COMPATTAZIONE_SECONDI', '300'))
+# Partizionamento per mese: il database principale tiene solo gli ultimi MESI_ATTIVI mesi,
+# i mesi più vecchi vengono spostati in un file SQLite per mese dentro ARCHIVIO_DIR.
+MESI_ATTIVI = int(os.getenv('REGISTRO_MESI_ATTIVI', '3'))
+ARCHIVIO_DIR = "archivio_registro"
+# ProfitBot e Cruiser sono processi separati: il journal e la compattazione sono coordinati con lock su file
+LOCK_JOURNAL = "Registro_Vendite.journal.lock"
+LOCK_COMPATTAZIONE = "Registro_Vendite.compattazione.lock"
+
+INTESTAZIONE = ["DATA", "ORA", "ASIN", "TITOLO", "PREZZO_VECCHIO", "PREZZO_NUOVO", "LINK_AFFILIATO", "FILE_ID", "TIPO_PUBBLICAZIONE"]
+
+# Stesso ordine delle colonne dell'xlsx: le righe restituite si indicizzano come prima (row[2] = ASIN, ecc.)
+COLONNE = "data, ora, asin, titolo, prezzo_vecchio, prezzo_nuovo, link, file_id, tipo_pubblicazione"
+
+SCHEMA_VENDITE = """
+CREATE TABLE IF NOT EXISTS vendite (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    data TEXT NOT NULL,
+    ora TEXT,
+    asin TEXT,
+    titolo TEXT,
+    prezzo_vecchio TEXT,
+    prezzo_nuovo TEXT,
+    link TEXT,
+    file_id TEXT,
+    tipo_pubblicazione TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_vendite_asin ON vendite(asin, id);
+CREATE INDEX IF NOT EXISTS idx_vendite_data ON vendite(data, id);
+"""
+
+SCHEMA = SCHEMA_VENDITE + """
+CREATE TABLE IF NOT EXISTS ultime_per_asin (
+    asin TEXT PRIMARY KEY,
+    id INTEGER,
+    data TEXT,
+    ora TEXT,
+    titolo TEXT,
+    prezzo_vecchio TEXT,
+    prezzo_nuovo TEXT,
+    link TEXT,
+    file_id TEXT,
+    tipo_pubblicazione TEXT
+);
+CREATE TABLE IF NOT EXISTS riassunto_giorno (
+    data TEXT NOT NULL,
+    asin TEXT NOT NULL,
+    titolo TEXT,
+    prezzo_vecchio REAL,
+    prezzo_nuovo REAL,
+    link TEXT,
+    sconto_perc INTEGER,
+    primo_id INTEGER,
+    PRIMARY KEY (data, asin)
+);
+CREATE INDEX IF NOT EXISTS idx_riassunto_sconto ON riassunto_giorno(data, sconto_perc DESC, primo_id);
+CREATE TABLE IF NOT EXISTS meta (
+    chiave TEXT PRIMARY KEY,
+    valore TEXT
+);
+"""
+
+# Mese 'YYYY-MM' ricavato dalla colonna data (dd/mm/YYYY)
+MESE_SQL = "substr(data, 7, 4) || '-' || substr(data, 4, 2)"
+
+_locale = threading.local()
+
+
+# --- LOCK TRA PROCESSI ---
+@contextmanager
+def _lock_file(percorso, bloccante=True):
+    """Lock esclusivo su file. Con bloccante=False restituisce False se il lock è già preso."""
+    f = open(percorso, 'a+')
+    preso = False
+    try:
+        try:
+            if fcntl:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX if bloccante else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK if bloccante else msvcrt.LK_NBLCK, 1)
+            preso = True
+        except OSError:
+            if bloccante:
+                raise
+        yield preso
+    finally:
+        if preso:
+            if fcntl:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        f.close()
+
+
+def _salva_atomico(wb, percorso):
+    """Salva su file temporaneo e rinomina: chi legge non vede mai un xlsx a metà."""
+    tmp = percorso + ".tmp"
+    wb.save(tmp)
+    os.replace(tmp, percorso)
+
+
+# --- CONNESSIONE ---
+def _connessione():
+    """Una connessione per thread, con lo schema garantito alla prima apertura."""
+    conn = getattr(_locale, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(DB_SQLITE, timeout=30)
+        # WAL: le letture non si bloccano durante le scritture dell'altro bot
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+        _locale.conn = conn
+    return conn
+
+
+def chiudi_connessione():
+    conn = getattr(_locale, 'conn', None)
+    if conn is not None:
+        conn.close()
+        _locale.conn = None
+
+
+def inizializza_registro():
+    """Crea lo schema e, al primo avvio, importa lo storico dall'xlsx esistente."""
+    with _lock_file(LOCK_COMPATTAZIONE):
+        conn = _connessione()
+        # Registro mai usato: la tabella principale può essere vuota anche perché tutti i mesi sono archiviati
+        vuoto = ultimo_id() == 0
+        if vuoto and os.path.exists(DB_FILE):
+            importa_xlsx(DB_FILE)
+        if conn.execute("SELECT 1 FROM ultime_per_asin LIMIT 1").fetchone() is None:
+            with conn:
+                conn.execute(
+                    f"INSERT INTO ultime_per_asin (id, {COLONNE}) SELECT id, {COLONNE} FROM vendite "
+                    "WHERE id IN (SELECT MAX(id) FROM vendite WHERE asin IS NOT NULL GROUP BY asin)"
+                )
+        ricostruisci_riassunto(datetime.now().strftime("%d/%m/%Y"))
+        _archivia_se_serve()
+
+
+def importa_xlsx(percorso=DB_FILE):
+    """Copia nel registro tutte le righe di un Registro_Vendite.xlsx."""
+    from openpyxl import load_workbook
+
+    wb = load_workbook(percorso, read_only=True)
+    ws = wb.active
+    righe = []
+    for row in ws.iter_rows(min_row=2, values_only=True):
+        if not row or row[0] is None:
+            continue
+        valori = list(row[:9]) + [None] * (9 - len(row[:9]))
+        if isinstance(valori[0], datetime):
+            # Celle convertite in data da Excel: riportate al formato dd/mm/YYYY usato dai bot
+            valori[0] = valori[0].strftime("%d/%m/%Y")
+        righe.append([str(v) if v is not None else None for v in valori])
+    wb.close()
+
+    conn = _connessione()
+    with conn:
+        conn.executemany(f"INSERT INTO vendite ({COLONNE}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", righe)
+    if percorso == DB_FILE:
+        # Queste righe sono già nell'xlsx: la compattazione ripartirà da qui
+        _scrivi_meta('xlsx_ultimo_id', conn.execute("SELECT COALESCE(MAX(id), 0) FROM vendite").fetchone()[0])
+    print(f"📥 Importate {len(righe)} righe da {percorso} nel registro.")
+    return len(righe)
+
+
+# --- SCRITTURA ---
+def registra_vendita(asin, titolo, prezzo_vecchio, prezzo_nuovo, link, file_id, tipo_pubblicazione=None, adesso=None):
+    """Aggiunge una riga al registro e ne restituisce l'id."""
+    adesso = adesso or datetime.now()
+    riga = (
+        adesso.strftime("%d/%m/%Y"),
+        adesso.strftime("%H:%M:%S"),
+        asin, titolo, prezzo_vecchio, prezzo_nuovo, link, file_id, tipo_pubblicazione
+    )
+    conn = _connessione()
+    # Insert e append sotto lo stesso lock: nel journal gli id sono sempre in ordine crescente,
+    # anche con i due bot che scrivono insieme. Il lock copre solo operazioni brevi.
+    with _lock_file(LOCK_JOURNAL):
+        with conn:
+            cur = conn.execute(f"INSERT INTO vendite ({COLONNE}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", riga)
+            _aggiorna_riassunto(conn, cur.lastrowid, riga)
+            if asin:
+                conn.execute(f"INSERT OR REPLACE INTO ultime_per_asin (id, {COLONNE}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", (cur.lastrowid,) + riga)
+        _scrivi_journal(cur.lastrowid, riga)
+    return cur.lastrowid
+
+
+def _scrivi_journal(id_riga, riga):
+    """Accoda il record al journal: costo costante, indipendente dalla dimensione dello storico."""
+    record = json.dumps({'id': id_riga, 'riga': list(riga)}, ensure_ascii=False)
+    with open(JOURNAL_FILE, 'a', encoding='utf-8') as f:
+        f.write(record + "\n")
+        f.flush()
+
+
+# --- RIASSUNTO GIORNALIERO MATERIALIZZATO ---
+def valore_prezzo(price_str):
+    """Prezzo testuale -> float (es. '1.234,56€' -> 1234.56, 0.0 se non leggibile).
+
+    Unico parser dei prezzi: lo usano anche ProfitBot e Cruiser (clean_price_calc), così il filtro
+    del riassunto non può divergere da quello dei bot.
+    """
+    if not isinstance(price_str, str): return 0.0
+    price_str = price_str.replace('€', '').replace('$', '').strip()
+    # Logica per gestire il separatore decimale italiano
+    if price_str.count(',') == 1 and price_str.count('.') <= 1 and price_str.rfind(',') > price_str.rfind('.'):
+        price_str = price_str.replace('.', '').replace(',', '.')
+    else:
+        price_str = price_str.replace(',', '')
+    try:
+        return float(price_str)
+    except ValueError:
+        return 0.0
+
+
+def _aggiorna_riassunto(conn, id_riga, riga):
+    """Aggiorna il riassunto del giorno con una nuova riga (stesso filtro di get_riassunto_offerte)."""
+    data, _, asin, titolo, prezzo_vecchio, prezzo_nuovo, link = riga[:7]
+    old_val = valore_prezzo(prezzo_vecchio)
+    new_val = valore_prezzo(prezzo_nuovo)
+    if asin == 'N/A' or not (old_val > new_val and old_val > 0):
+        return
+    perc = int(100 - (new_val / old_val * 100))
+    # L'ultima riga dell'ASIN vince, ma resta la posizione della prima (come nel vecchio dict record_oggi)
+    conn.execute(
+        "INSERT INTO riassunto_giorno (data, asin, titolo, prezzo_vecchio, prezzo_nuovo, link, sconto_perc, primo_id) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+        "ON CONFLICT(data, asin) DO UPDATE SET titolo = excluded.titolo, prezzo_vecchio = excluded.prezzo_vecchio, "
+        "prezzo_nuovo = excluded.prezzo_nuovo, link = excluded.link, sconto_perc = excluded.sconto_perc",
+        (data, asin, titolo, old_val, new_val, link, perc, id_riga)
+    )
+
+
+def ricostruisci_riassunto(data_str):
+    """Ricalcola il riassunto di una data dalle righe del registro (es. dopo l'import dall'xlsx)."""
+    conn = _connessione()
+    with conn:
+        conn.execute("DELETE FROM riassunto_giorno WHERE data = ?", (data_str,))
+        for row in conn.execute(f"SELECT id, {COLONNE} FROM vendite WHERE data = ? ORDER BY id", (data_str,)).fetchall():
+            _aggiorna_riassunto(conn, row[0], row[1:])
+
+
+def migliori_offerte_del_giorno(data_str, limite=5):
+    """Top N ribassi del giorno per sconto: (asin, titolo, prezzo_vecchio, prezzo_nuovo, link, sconto_perc)."""
+    return _connessione().execute(
+        "SELECT asin, titolo, prezzo_vecchio, prezzo_nuovo, link, sconto_perc FROM riassunto_giorno "
+        "WHERE data = ? ORDER BY sconto_perc DESC, primo_id LIMIT ?", (data_str, limite)
+    ).fetchall()
+
+
+# --- LETTURA (tutte su indice) ---
+# Le ricerche per ASIN passano da ultime_per_asin, che copre anche i mesi già archiviati.
+def ultima_vendita(asin):
+    """Ultima riga registrata per l'ASIN, o None."""
+    return _connessione().execute(
+        f"SELECT {COLONNE} FROM ultime_per_asin WHERE asin = ?", (asin,)
+    ).fetchone()
+
+
+def esiste_asin(asin):
+    return _connessione().execute("SELECT 1 FROM ultime_per_asin WHERE asin = ?", (asin,)).fetchone() is not None
+
+
+def vendite_del_giorno(data_str):
+    """Righe di una data (formato dd/mm/YYYY) in ordine di inserimento."""
+    return _connessione().execute(
+        f"SELECT {COLONNE} FROM vendite WHERE data = ? ORDER BY id", (data_str,)
+    ).fetchall()
+
+
+def ultime_vendite_per_asin():
+    """Ultima riga di ogni ASIN, preceduta dal suo id: serve a costruire indici in memoria."""
+    return _connessione().execute(
+        f"SELECT id, {COLONNE} FROM ultime_per_asin ORDER BY id"
+    ).fetchall()
+
+
+def vendite_dopo(id_riga):
+    """Righe inserite dopo un certo id (anche dall'altro bot), precedute dal loro id."""
+    return _connessione().execute(
+        f"SELECT id, {COLONNE} FROM vendite WHERE id > ? ORDER BY id", (id_riga,)
+    ).fetchall()
+
+
+# --- PARTIZIONI MENSILI E ARCHIVIO ---
+def _percorso_archivio(mese):
+    return os.path.join(ARCHIVIO_DIR, f"Registro_Vendite_{mese.replace('-', '_')}.sqlite")
+
+
+def mesi_archiviati():
+    """Mesi ('YYYY-MM') presenti nell'archivio, dal più vecchio."""
+    if not os.path.isdir(ARCHIVIO_DIR):
+        return []
+    mesi = []
+    for nome in os.listdir(ARCHIVIO_DIR):
+        m = re.match(r'Registro_Vendite_(\d{4})_(\d{2})\.sqlite$', nome)
+        if m:
+            mesi.append(f"{m.group(1)}-{m.group(2)}")
+    return sorted(mesi)
+
+
+def archivia_partizioni(mesi_attivi=MESI_ATTIVI, adesso=None):
+    """Sposta nell'archivio i mesi più vecchi degli ultimi `mesi_attivi`. Restituisce i mesi spostati."""
+    adesso = adesso or datetime.now()
+    anno, mese = adesso.year, adesso.month - (mesi_attivi - 1)
+    while mese <= 0:
+        mese += 12
+        anno -= 1
+    primo_mese_attivo = f"{anno:04d}-{mese:02d}"
+
+    conn = _connessione()
+    mesi = [r[0] for r in conn.execute(f"SELECT DISTINCT {MESE_SQL} FROM vendite")]
+    mesi = sorted(m for m in mesi if m and re.match(r'^\d{4}-\d{2}$', m) and m < primo_mese_attivo)
+
+    os.makedirs(ARCHIVIO_DIR, exist_ok=True)
+    for m in mesi:
+        righe = conn.execute(f"SELECT id, {COLONNE} FROM vendite WHERE {MESE_SQL} = ? ORDER BY id", (m,)).fetchall()
+        arch = sqlite3.connect(_percorso_archivio(m))
+        try:
+            arch.executescript(SCHEMA_VENDITE)
+            with arch:
+                # INSERT OR IGNORE: se un'archiviazione precedente si è interrotta, ripeterla è innocuo
+                arch.executemany(f"INSERT OR IGNORE INTO vendite (id, {COLONNE}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", righe)
+        finally:
+            arch.close()
+        with conn:
+            conn.execute(f"DELETE FROM vendite WHERE {MESE_SQL} = ?", (m,))
+            conn.execute(f"DELETE FROM riassunto_giorno WHERE {MESE_SQL} = ?", (m,))
+        print(f"🗄️ Registro: archiviato {m} ({len(righe)} righe) in {_percorso_archivio(m)}.")
+    return mesi
+
+
+def _archivia_se_serve():
+    """Archiviazione automatica, al massimo una volta al giorno (chiamata con LOCK_COMPATTAZIONE preso)."""
+    oggi = datetime.now().strftime("%Y-%m-%d")
+    if _leggi_meta('ultima_archiviazione') == oggi:
+        return
+    archivia_partizioni()
+    _scrivi_meta('ultima_archiviazione', oggi)
+
+
+def vendite_storiche(asin=None, fino_a_id=None):
+    """Tutte le righe, archivi compresi, in ordine cronologico (per report ed esportazioni).
+
+    Generatore: scorre un mese archiviato alla volta e infine il database principale.
+    """
+    filtro, parametri = [], []
+    if asin is not None:
+        filtro.append("asin = ?")
+        parametri.append(asin)
+    if fino_a_id is not None:
+        filtro.append("id <= ?")
+        parametri.append(fino_a_id)
+    where = f"WHERE {' AND '.join(filtro)}" if filtro else ""
+    query = f"SELECT {COLONNE} FROM vendite {where} ORDER BY id"
+
+    for m in mesi_archiviati():
+        arch = sqlite3.connect(_percorso_archivio(m))
+        try:
+            yield from arch.execute(query, parametri)
+        finally:
+            arch.close()
+    yield from _connessione().execute(query, parametri).fetchall()
+
+
+# --- META ---
+def _leggi_meta(chiave, default=None):
+    row = _connessione().execute("SELECT valore FROM meta WHERE chiave = ?", (chiave,)).fetchone()
+    return row[0] if row else default
+
+
+def _scrivi_meta(chiave, valore):
+    conn = _connessione()
+    with conn:
+        conn.execute("INSERT OR REPLACE INTO meta (chiave, valore) VALUES (?, ?)", (chiave, str(valore)))
+
+
+# --- ESPORTAZIONE XLSX ---
+def ultimo_id():
+    """Id dell'ultima riga registrata, anche se il suo mese è già stato archiviato.
+
+    MAX(id) del database principale non basta: dopo l'archiviazione può essere vuoto.
+    Con AUTOINCREMENT sqlite_sequence ricorda l'id più alto mai assegnato.
+    """
+    conn = _connessione()
+    massimo = conn.execute("SELECT COALESCE(MAX(id), 0) FROM vendite").fetchone()[0]
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'vendite'").fetchone()
+    return max(massimo, row[0] if row else 0)
+
+
+def esporta_xlsx(percorso=DB_FILE, fino_a_id=None):
+    """Rigenera l'xlsx completo a partire dal registro (opzionalmente fino a un certo id)."""
+    from openpyxl import Workbook
+
+    if fino_a_id is None:
+        fino_a_id = ultimo_id()
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Registro Vendite")
+    ws.append(INTESTAZIONE)
+    for row in vendite_storiche(fino_a_id=fino_a_id):
+        ws.append(list(row))
+    _salva_atomico(wb, percorso)
+    if percorso == DB_FILE:
+        _scrivi_meta('xlsx_ultimo_id', fino_a_id)
+    return percorso
+
+
+# --- COMPATTAZIONE JOURNAL -> XLSX ---
+def compatta_journal():
+    """Riversa nell'xlsx, con un solo salvataggio, tutti i record accumulati nel journal.
+
+    Un solo compattatore alla volta tra i due bot: se l'altro processo sta già
+    compattando si salta il giro (restituisce 0).
+    """
+    with _lock_file(LOCK_COMPATTAZIONE, bloccante=False) as preso:
+        if not preso:
+            return 0
+        return _compatta_journal()
+
+
+def _compatta_journal():
+    _archivia_se_serve()
+    in_lavorazione = JOURNAL_FILE + ".compattazione"
+    if not os.path.exists(in_lavorazione):
+        with _lock_file(LOCK_JOURNAL):
+            if not os.path.exists(JOURNAL_FILE) or os.path.getsize(JOURNAL_FILE) == 0:
+                return 0
+            # Le nuove scritture finiscono in un journal nuovo mentre compattiamo questo
+            os.replace(JOURNAL_FILE, in_lavorazione)
+
+    ultimo_id = int(_leggi_meta('xlsx_ultimo_id', 0))
+    records = []
+    with open(in_lavorazione, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # Riga troncata da un crash durante la scrittura: il dato è comunque nel registro SQLite
+                continue
+            if record['id'] > ultimo_id:
+                records.append(record)
+
+    if records:
+        records.sort(key=lambda r: r['id'])
+        nuovo_ultimo_id = records[-1]['id']
+        if os.path.exists(DB_FILE):
+            from openpyxl import load_workbook
+            wb = load_workbook(DB_FILE)
+            ws = wb.active
+            for record in records:
+                ws.append(record['riga'])
+            _salva_atomico(wb, DB_FILE)
+            _scrivi_meta('xlsx_ultimo_id', nuovo_ultimo_id)
+        else:
+            esporta_xlsx(DB_FILE, fino_a_id=nuovo_ultimo_id)
+
+    os.remove(in_lavorazione)
+    return len(records)
+
+
+def avvia_compattazione(intervallo=COMPATTAZIONE_SECONDI):
+    """Thread in background che compatta periodicamente il journal nell'xlsx."""
+    def _ciclo():
+        while True:
+            time.sleep(intervallo)
+            try:
+                n = compatta_journal()
+                if n:
+                    print(f"🗜️ Compattazione registro: {n} record riversati in {DB_FILE}.")
+            except Exception as e:
+                print(f"Errore compattazione registro: {e}")
+
+    t = threading.Thread(target=_ciclo, name="compattazione-registro", daemon=True)
+    t.start()
+    return t
+
+
+# --- STRESS TEST SCRITTORI CONCORRENTI ---
+def _scrittore_stress(nome, n_record):
+    for i in range(n_record):
+        registra_vendita(f"B0STRESS{nome[:2]}", f"{nome}-{i}", "10,00", "9,00", "", "N/A", nome)
+    chiudi_connessione()
+
+
+def stress(n_record=500):
+    """Due processi (come ProfitBot e Cruiser) scrivono a piena velocità mentre si compatta.
+
+    Gira in una cartella temporanea e verifica che registro e xlsx contengano
+    tutti i record, senza perdite né duplicati.
+    """
+    import tempfile
+    import multiprocessing
+    from openpyxl import load_workbook
+
+    cartella = tempfile.mkdtemp(prefix="stress_registro_")
+    os.chdir(cartella)
+    chiudi_connessione()
+    inizializza_registro()
+    chiudi_connessione()
+
+    inizio = time.time()
+    processi = [multiprocessing.Process(target=_scrittore_stress, args=(nome, n_record)) for nome in ("PROFITBOT", "CRUISER")]
+    for p in processi:
+        p.start()
+    compattazioni = 0
+    while any(p.is_alive() for p in processi):
+        compattazioni += 1 if compatta_journal() else 0
+        time.sleep(0.05)
+    for p in processi:
+        p.join()
+    durata = time.time() - inizio
+    compatta_journal()
+
+    attesi = {f"{nome}-{i}" for nome in ("PROFITBOT", "CRUISER") for i in range(n_record)}
+    nel_db = [r[0] for r in _connessione().execute("SELECT titolo FROM vendite")]
+    wb = load_workbook(DB_FILE, read_only=True)
+    nell_xlsx = [row[3] for row in wb.active.iter_rows(min_row=2, values_only=True)]
+    wb.close()
+
+    ok = (sorted(nel_db) == sorted(attesi) and sorted(nell_xlsx) == sorted(attesi))
+    print(f"{'✅' if ok else '❌'} Stress registro: {2 * n_record} scritture in {durata:.2f}s "
+          f"({2 * n_record / durata:.0f} rec/s), {compattazioni} compattazioni intermedie. "
+          f"DB: {len(nel_db)} righe, xlsx: {len(nell_xlsx)} righe, attese: {len(attesi)}. Cartella: {cartella}")
+    return ok
+
+
+if __name__ == '__main__':
+    import sys
+
+    comando = sys.argv[1] if len(sys.argv) > 1 else "esporta"
+    if comando == "stress":
+        n = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+        sys.exit(0 if stress(n) else 1)
+
+    inizializza_registro()
+    if comando == "esporta":
+        print(f"✅ Registro esportato in {esporta_xlsx()}")
+    elif comando == "compatta":
+        print(f"✅ {compatta_journal()} record riversati in {DB_FILE}")
+    elif comando == "archivia":
+        print(f"✅ Mesi archiviati: {archivia_partizioni() or 'nessuno'}")
+    else:
+        print(f"❌ Comando sconosciuto: {comando}. Uso: python registro.py [esporta|compatta|archivia|stress [n]]")
@@ -0,0 +1,722 @@
+import os
+import re
+import html
+import importlib.util
+import time
+import random
+import urllib.parse
+from collections import deque
+import sqlite3
+import threading
+import http.cookiejar
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from bs4 import BeautifulSoup
+
+# --- CONFIGURAZIONE HTTP CONDIVISA (ProfitBot + Cruiser) ---
+# Una sola sessione keep-alive con pool di connessioni: le richieste ripetute ad amazon.it
+# riusano la connessione TCP+TLS già aperta invece di rifare l'handshake ogni volta.
+POOL_CONNESSIONI = int(os.getenv('SCRAPER_POOL_CONNESSIONI', '10'))
+TIMEOUT_CONNESSIONE = float(os.getenv('SCRAPER_TIMEOUT_CONNESSIONE', '5'))
+TIMEOUT_LETTURA = float(os.getenv('SCRAPER_TIMEOUT_LETTURA', '15'))
+
+# requests/urllib3 decodificano 'br' solo se il pacchetto brotli è installato
+ACCEPT_ENCODING = 'gzip, deflate, br' if importlib.util.find_spec('brotli') else 'gzip, deflate'
+
+# Pool di uscite (proxy HTTP) separati da virgola, es. "http://10.0.0.2:3128,http://user:pw@10.0.0.3:3128".
+# Vuoto: le richieste escono direttamente. Ogni richiesta va all'uscita più in salute; un'uscita bloccata
+# (503/429/CAPTCHA) va in panchina per PANCHINA_SECONDI, raddoppiati a ogni blocco recente.
+PROXIES = [p.strip() for p in os.getenv('SCRAPER_PROXIES', '').split(',') if p.strip()]
+PANCHINA_SECONDI = int(os.getenv('SCRAPER_PANCHINA_SECONDI', '600'))
+PANCHINA_MAX_SECONDI = int(os.getenv('SCRAPER_PANCHINA_MAX_SECONDI', '21600'))
+FINESTRA_CAPTCHA_SECONDI = 1800
+
+# Cache su disco dei dati estratti, per ASIN, condivisa tra i due bot: se il Cruiser ha appena
+# letto un prodotto, ProfitBot lo apre subito senza una nuova richiesta ad Amazon.
+CACHE_FILE = "cache_pagine.sqlite"
+CACHE_TTL_SECONDI = int(os.getenv('SCRAPER_CACHE_TTL_SECONDI', '900'))
+CACHE_MAX_VOCI = int(os.getenv('SCRAPER_CACHE_MAX_VOCI', '5000'))
+
+# Download in streaming: la pagina si legge a blocchi e la connessione si chiude appena
+# titolo, prezzo e disponibilità sono già nella parte ricevuta (SCRAPER_STREAMING=0 per disattivare).
+STREAMING = os.getenv('SCRAPER_STREAMING', '1') == '1'
+BLOCCO_STREAMING = int(os.getenv('SCRAPER_BLOCCO_STREAMING', '65536'))
+
+_sessione = None
+_adapter = None
+_lock = threading.Lock()
+_richieste = 0
+_connessioni_tcp = 0
+
+
+# --- CONTEGGIO DELLE CONNESSIONI TCP ---
+# Le statistiche del pool di urllib3 contano gli oggetti connessione, non le connessioni TCP:
+# una connessione chiusa (dal server o dopo un download interrotto) viene riaperta dallo
+# stesso oggetto senza che il pool se ne accorga. Si conta quindi ogni connect() vero.
+def _conta_connessione():
+    global _connessioni_tcp
+    with _lock:
+        _connessioni_tcp += 1
+
+
+class _ConnessioneHTTP(HTTPConnection):
+    def connect(self):
+        _conta_connessione()
+        super().connect()
+
+
+class _ConnessioneHTTPS(HTTPSConnection):
+    def connect(self):
+        _conta_connessione()
+        super().connect()
+
+
+class _PoolHTTP(HTTPConnectionPool):
+    ConnectionCls = _ConnessioneHTTP
+
+
+class _PoolHTTPS(HTTPSConnectionPool):
+    ConnectionCls = _ConnessioneHTTPS
+
+
+_POOL_CONTATI = {'http': _PoolHTTP, 'https': _PoolHTTPS}
+
+
+class _AdapterContato(HTTPAdapter):
+    """HTTPAdapter i cui pool (diretti e via proxy) usano le connessioni contate."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = _POOL_CONTATI
+
+    def proxy_manager_for(self, proxy, **proxy_kwargs):
+        manager = super().proxy_manager_for(proxy, **proxy_kwargs)
+        manager.pool_classes_by_scheme = _POOL_CONTATI
+        return manager
+
+
+def sessione():
+    """Sessione requests condivisa, creata alla prima chiamata."""
+    global _sessione, _adapter
+    with _lock:
+        if _sessione is None:
+            s = requests.Session()
+            # pool_block: con il pool pieno si aspetta una connessione libera invece di aprirne una usa-e-getta
+            _adapter = _AdapterContato(pool_connections=4, pool_maxsize=POOL_CONNESSIONI, pool_block=True, max_retries=0)
+            s.mount('https://', _adapter)
+            s.mount('http://', _adapter)
+            s.headers.update({'Accept-Encoding': ACCEPT_ENCODING, 'Connection': 'keep-alive'})
+            # Nessun cookie tra una richiesta e l'altra: ogni fetch resta indipendente come prima
+            s.cookies.set_policy(http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+            _sessione = s
+    return _sessione
+
+
+def scarica(url, headers=None, timeout=None, uscita=None, **kwargs):
+    """GET tramite la sessione condivisa. timeout: secondi di lettura (default TIMEOUT_LETTURA).
+
+    uscita: nome dell'uscita da usare (vedi scegli_uscita); se manca si sceglie la più in salute.
+    L'esito (OK, blocco, timeout, errore) aggiorna il punteggio dell'uscita; la risposta ha
+    l'attributo `uscita` per segnalare poi un CAPTCHA con segnala_captcha().
+    """
+    global _richieste
+    with _lock:
+        _richieste += 1
+    u = _uscite[uscita] if uscita else _uscite[scegli_uscita()]
+    if u.proxy:
+        kwargs.setdefault('proxies', {'http': u.proxy, 'https': u.proxy})
+    with _lock:
+        u.in_uso += 1
+    inizio = time.monotonic()
+    try:
+        risposta = sessione().get(url, headers=headers, timeout=(TIMEOUT_CONNESSIONE, timeout or TIMEOUT_LETTURA), **kwargs)
+    except requests.exceptions.Timeout:
+        u.registra('timeout', time.monotonic() - inizio)
+        raise
+    except requests.exceptions.RequestException:
+        u.registra('errore', time.monotonic() - inizio)
+        raise
+    finally:
+        with _lock:
+            u.in_uso -= 1
+    u.registra('blocco' if risposta.status_code in (503, 429) else 'ok', time.monotonic() - inizio)
+    risposta.uscita = u.nome
+    return risposta
+
+
+# --- POOL DI USCITE (PROXY) CON PUNTEGGIO DI SALUTE ---
+class Uscita:
+    """Un'uscita verso Internet (proxy o connessione diretta) con le sue statistiche di salute."""
+
+    def __init__(self, proxy=None):
+        self.proxy = proxy
+        if proxy:
+            parti = urllib.parse.urlparse(proxy)
+            self.nome = f"{parti.hostname}:{parti.port}" if parti.port else parti.hostname
+        else:
+            self.nome = 'diretto'
+        self.successo = 1.0  # media mobile: 1 = tutte le richieste riuscite
+        self.latenza = None  # media mobile in secondi fino alle intestazioni (None: mai usata, si prova subito)
+        self.richieste = 0
+        self.blocchi = 0
+        self.captcha_recenti = deque()
+        self.panchina_fino = 0.0
+        self.in_uso = 0
+
+    def _pulisci_captcha(self, adesso):
+        while self.captcha_recenti and adesso - self.captcha_recenti[0] > FINESTRA_CAPTCHA_SECONDI:
+            self.captcha_recenti.popleft()
+
+    def registra(self, esito, latenza):
+        """esito: 'ok', 'blocco' (503/429/CAPTCHA), 'timeout' o 'errore'."""
+        with _lock:
+            adesso = time.time()
+            self.richieste += 1
+            self.successo = 0.8 * self.successo + 0.2 * (1.0 if esito == 'ok' else 0.0)
+            if esito == 'ok':
+                self.latenza = latenza if self.latenza is None else 0.8 * self.latenza + 0.2 * latenza
+            if esito != 'blocco':
+                return
+            self.blocchi += 1
+            self._pulisci_captcha(adesso)
+            self.captcha_recenti.append(adesso)
+            # Con una sola uscita la pausa la decide chi chiama (es. il circuit breaker del Cruiser)
+            if len(_uscite) > 1:
+                pausa = min(PANCHINA_MAX_SECONDI, PANCHINA_SECONDI * 2 ** (len(self.captcha_recenti) - 1))
+                self.panchina_fino = adesso + pausa
+                print(f"🪑 Uscita {self.nome} in panchina per {pausa}s ({len(self.captcha_recenti)} blocchi recenti).")
+
+    def punteggio(self, adesso):
+        """Più alto è meglio: successo recente, latenza bassa, pochi CAPTCHA, poche richieste in corso."""
+        self._pulisci_captcha(adesso)
+        return self.successo / (1 + (self.latenza or 0.0)) / (1 + len(self.captcha_recenti)) / (1 + self.in_uso)
+
+
+_uscite = {u.nome: u for u in ([Uscita(p) for p in PROXIES] or [Uscita()])}
+
+
+def uscite():
+    """Nomi delle uscite configurate (['diretto'] senza proxy)."""
+    return list(_uscite)
+
+
+def scegli_uscita(escludi=()):
+    """Nome dell'uscita più in salute fuori panchina, saltando quelle in `escludi`.
+
+    Se sono tutte in panchina (o escluse) restituisce quella che torna disponibile per prima.
+    """
+    with _lock:
+        adesso = time.time()
+        candidate = [u for u in _uscite.values() if u.panchina_fino <= adesso and u.nome not in escludi]
+        if not candidate:
+            return min(_uscite.values(), key=lambda u: u.panchina_fino).nome
+        migliore = max(u.punteggio(adesso) for u in candidate)
+        # A parità di punteggio si distribuisce a caso, così le uscite nuove vengono provate tutte
+        return random.choice([u for u in candidate if u.punteggio(adesso) >= migliore * 0.999]).nome
+
+
+def segnala_captcha(risposta):
+    """Da chiamare quando una risposta 200 è in realtà una pagina CAPTCHA: conta come blocco dell'uscita.
+
+    I 503/429 sono già contati da scarica().
+    """
+    nome = getattr(risposta, 'uscita', None)
+    if risposta.status_code == 200 and nome in _uscite:
+        _uscite[nome].registra('blocco', 0.0)
+
+
+def statistiche_uscite():
+    """Per ogni uscita: richieste, blocchi, successo e latenza medi, CAPTCHA recenti, secondi di panchina residui."""
+    with _lock:
+        adesso = time.time()
+        return {
+            u.nome: {
+                'richieste': u.richieste,
+                'blocchi': u.blocchi,
+                'successo': round(u.successo, 2),
+                'latenza_ms': round(1000 * u.latenza) if u.latenza is not None else None,
+                'captcha_recenti': len(u.captcha_recenti),
+                'panchina_secondi': max(0, round(u.panchina_fino - adesso)),
+                'punteggio': round(u.punteggio(adesso), 3),
+            }
+            for u in _uscite.values()
+        }
+
+
+def statistiche_connessioni():
+    """Richieste fatte, connessioni TCP aperte (compresi i riconnect) e richieste che hanno riusato una connessione."""
+    with _lock:
+        richieste, connessioni = _richieste, _connessioni_tcp
+    riutilizzate = max(0, richieste - connessioni)
+    return {
+        'richieste': richieste,
+        'connessioni_aperte': connessioni,
+        'riutilizzate': riutilizzate,
+        'percentuale_riuso': round(100 * riutilizzate / richieste, 1) if richieste else 0.0,
+    }
+
+
+# --- DOWNLOAD IN STREAMING CON INTERRUZIONE ANTICIPATA ---
+_statistiche_streaming = {
+    'download': 0, 'interrotti': 0, 'byte_letti': 0, 'byte_risparmiati': 0,
+    'completi': 0, 'byte_completi': 0, 'senza_lunghezza': 0, 'byte_senza_lunghezza': 0,
+}
+
+
+def scarica_parziale(url, headers=None, timeout=None, catena=None, uscita=None):
+    """Come scarica(), ma legge la pagina a blocchi e si ferma appena contiene tutti i campi da estrarre.
+
+    Restituisce (risposta, contenuto, lettura): `contenuto` sono i byte decodificati letti
+    (da passare a estrai_dati_prodotto), `lettura` un dict con byte_letti e byte_totali dalla rete,
+    byte_risparmiati (None se il server non dichiara la lunghezza) e interrotto.
+    """
+    if not STREAMING:
+        risposta = scarica(url, headers=headers, timeout=timeout, uscita=uscita)
+        return risposta, risposta.content, {'byte_letti': len(risposta.content), 'byte_totali': len(risposta.content), 'byte_risparmiati': 0, 'interrotto': False}
+
+    catena = list(catena or CATENA_PREZZO)
+    risposta = scarica(url, headers=headers, timeout=timeout, uscita=uscita, stream=True)
+    letti = bytearray()
+    interrotto = False
+    try:
+        if risposta.status_code == 200:
+            titolo_trovato = False
+            for blocco in risposta.iter_content(chunk_size=BLOCCO_STREAMING):
+                letti += blocco
+                titolo_trovato = titolo_trovato or _RE_TITOLO.search(letti) is not None
+                if titolo_trovato and _prefisso_sufficiente(bytes(letti), catena):
+                    interrotto = True
+                    break
+        else:
+            letti += risposta.content
+        # Byte arrivati dalla rete (compressi), misurati prima di chiudere la connessione;
+        # con Transfer-Encoding chunked urllib3 non li conta e si usano quelli decodificati
+        byte_letti = risposta.raw.tell() or len(letti)
+    finally:
+        risposta.close()
+
+    lunghezza = risposta.headers.get('Content-Length', '')
+    if interrotto and lunghezza.isdigit() and byte_letti >= int(lunghezza):
+        interrotto = False  # campi trovati solo nell'ultimo blocco: pagina letta comunque per intero
+    byte_totali = int(lunghezza) if lunghezza.isdigit() else (None if interrotto else byte_letti)
+    risparmiati = 0
+    if interrotto:
+        risparmiati = max(0, byte_totali - byte_letti) if byte_totali is not None else None
+
+    with _lock:
+        st = _statistiche_streaming
+        st['download'] += 1
+        st['byte_letti'] += byte_letti
+        if interrotto:
+            st['interrotti'] += 1
+            if risparmiati is None:
+                st['senza_lunghezza'] += 1
+                st['byte_senza_lunghezza'] += byte_letti
+            else:
+                st['byte_risparmiati'] += risparmiati
+        elif risposta.status_code == 200:
+            st['completi'] += 1
+            st['byte_completi'] += byte_letti
+    return risposta, bytes(letti), {'byte_letti': byte_letti, 'byte_totali': byte_totali, 'byte_risparmiati': risparmiati, 'interrotto': interrotto}
+
+
+def _prefisso_sufficiente(prefisso, catena):
+    """True se estrarre dal prefisso dà per forza lo stesso risultato della pagina intera.
+
+    Serve che titolo e disponibilità siano completi e leggibili dal percorso veloce (senza tag
+    annidati) e che il prezzo venga dal primo selettore della catena: un selettore successivo
+    trovato ora potrebbe essere scavalcato da uno precedente che compare più avanti nella pagina.
+    """
+    titolo = _veloce_titolo(prefisso)
+    if titolo is None or titolo is INCERTO:
+        return False
+    veloce, _ = SELETTORI_PREZZO[catena[0]]
+    if veloce is None:
+        return False
+    prezzo = veloce(prefisso)
+    if not prezzo or prezzo is INCERTO:
+        return False
+    disponibilita = _veloce_disponibilita(prefisso)
+    return disponibilita is not None and disponibilita is not INCERTO
+
+
+def statistiche_streaming():
+    """Download fatti, quanti interrotti in anticipo e KB letti/risparmiati dalla rete.
+
+    Per le pagine interrotte senza Content-Length il risparmio è stimato con la dimensione
+    media delle pagine lette per intero.
+    """
+    with _lock:
+        st = dict(_statistiche_streaming)
+    media_completa = st['byte_completi'] / st['completi'] if st['completi'] else 0
+    stimati = max(0, st['senza_lunghezza'] * media_completa - st['byte_senza_lunghezza']) if media_completa else 0
+    return {
+        'download': st['download'],
+        'interrotti': st['interrotti'],
+        'kb_letti': round(st['byte_letti'] / 1024, 1),
+        'kb_risparmiati': round((st['byte_risparmiati'] + stimati) / 1024, 1),
+        'kb_media_pagina_completa': round(media_completa / 1024, 1),
+    }
+
+
+# --- ESTRAZIONE DATI PRODOTTO (unica per ProfitBot e Cruiser) ---
+# Il prezzo si cerca con una catena ordinata di selettori. Ogni selettore ha:
+#  - una versione veloce che scansiona i byte grezzi con pattern ancorati (None se non serve),
+#  - una versione BeautifulSoup, usata solo se il percorso veloce non riesce a decidere.
+# La versione veloce restituisce il testo trovato, None se l'elemento non c'è, oppure INCERTO
+# se la pagina ha una forma diversa dal previsto: in quel caso decide BeautifulSoup.
+INCERTO = object()
+
+_RE_TITOLO = re.compile(rb'<span[^>]*\bid="productTitle"[^>]*>(.*?)</span>', re.S)
+_RE_A_PRICE = re.compile(rb'<span[^>]*\sclass="(?:[^"]*\s)?a-price(?:\s[^"]*)?"[^>]*>')
+_RE_A_PRICE_AOK = re.compile(rb'<span[^>]*\sclass="a-price aok-align-center"[^>]*>')
+_RE_OFFSCREEN_INIZIALE = re.compile(rb'\s*<span class="a-offscreen">([^<]*)</span>')
+_RE_OFFSCREEN = re.compile(rb'<span[^>]*\sclass="(?:[^"]*\s)?a-offscreen(?:\s[^"]*)?"[^>]*>(.*?)</span>', re.S)
+_RE_AVAILABILITY = re.compile(rb'<div[^>]*\bid="availability"[^>]*>(.*?)</div>', re.S)
+_RE_TAG = re.compile(rb'<[^>]+>')
+
+
+def _re_altra_forma(tag, attributo, valore):
+    """Tag con `attributo` scritto in una forma che i pattern sopra non riconoscono (apici singoli,
+    senza virgolette, spazi attorno a '=') e che contiene `valore`: lì il percorso veloce non può
+    dire se l'elemento manca, quindi decide BeautifulSoup.
+    """
+    return re.compile(
+        rb'<' + tag + rb'\b[^>]*\s' + attributo + rb'(?!=")\s*=[^>]*?(?<![\w-])' + re.escape(valore) + rb'(?![\w-])'
+    )
+
+
+_ALTRA_A_PRICE_AOK = _re_altra_forma(b'span', b'class', b'a-price aok-align-center')
+_ALTRA_A_PRICE = _re_altra_forma(b'span', b'class', b'a-price')
+_ALTRA_OFFSCREEN = _re_altra_forma(b'span', b'class', b'a-offscreen')
+_ALTRA_AVAILABILITY = _re_altra_forma(b'div', b'id', b'availability')
+
+
+def _cerca(regex, altra_forma, contenuto):
+    """Primo match di `regex`, None se l'elemento manca, INCERTO se prima (o al posto) del match
+    c'è lo stesso elemento scritto in un'altra forma."""
+    m = regex.search(contenuto)
+    if altra_forma.search(contenuto, 0, m.start() if m else len(contenuto)):
+        return INCERTO
+    return m
+
+
+def _testo(frammento):
+    """Testo visibile di un frammento HTML (come .text di BeautifulSoup), senza spazi ai bordi."""
+    return html.unescape(_RE_TAG.sub(b'', frammento).decode('utf-8', errors='replace')).strip()
+
+
+def _span_semplice(frammento):
+    """Testo di uno span, o INCERTO se contiene altri span (il regex si sarebbe fermato troppo presto)."""
+    return INCERTO if b'<span' in frammento else _testo(frammento)
+
+
+def _veloce_titolo(contenuto):
+    """Titolo dal percorso veloce: None se manca, INCERTO se lo span contiene altri span."""
+    m = _RE_TITOLO.search(contenuto)
+    return _span_semplice(m.group(1)) if m else None
+
+
+def _veloce_disponibilita(contenuto):
+    """Testo disponibilità: None se manca, INCERTO se il div ne contiene altri (come per gli span)."""
+    m = _cerca(_RE_AVAILABILITY, _ALTRA_AVAILABILITY, contenuto)
+    if m is None or m is INCERTO:
+        return m
+    return INCERTO if b'<div' in m.group(1) else _testo(m.group(1))
+
+
+def _veloce_offscreen_figlio(regex_contenitore, altra_forma):
+    def selettore(contenuto):
+        m = _cerca(regex_contenitore, altra_forma, contenuto)
+        if m is None or m is INCERTO:
+            return m
+        # Ancorato: lo span a-offscreen deve essere il primo figlio del contenitore
+        m_off = _RE_OFFSCREEN_INIZIALE.match(contenuto, m.end())
+        return _testo(m_off.group(1)) if m_off else INCERTO
+    return selettore
+
+
+def _bs_offscreen_figlio(classe):
+    def selettore(soup):
+        tag = soup.find('span', class_=classe)
+        if tag:
+            price_text = tag.find('span', class_='a-offscreen')
+            if price_text:
+                return price_text.text.strip()
+        return None
+    return selettore
+
+
+_RE_PRICEBLOCK = [
+    (re.compile(rb'<span[^>]*\bid="' + id_prezzo + rb'"[^>]*>(.*?)</span>', re.S), _re_altra_forma(b'span', b'id', id_prezzo))
+    for id_prezzo in (b'priceblock_ourprice', b'priceblock_dealprice')
+]
+
+
+def _veloce_priceblock(contenuto):
+    for regex, altra_forma in _RE_PRICEBLOCK:
+        m = _cerca(regex, altra_forma, contenuto)
+        if m is INCERTO:
+            return INCERTO
+        if m:
+            return _span_semplice(m.group(1))
+    return None
+
+
+def _bs_priceblock(soup):
+    tag = soup.find('span', id='priceblock_ourprice') or soup.find('span', id='priceblock_dealprice')
+    return tag.text.strip() if tag else None
+
+
+def _bs_core_price(soup):
+    box = soup.find('div', id='corePriceDisplay_desktop_feature_div')
+    if box:
+        price_text = box.find('span', class_='a-offscreen')
+        if price_text:
+            return price_text.text.strip()
+    return None
+
+
+def _veloce_offscreen_valuta(contenuto):
+    # Un a-offscreen in un'altra forma prima di quello scelto (o in tutta la pagina se non se ne trova nessuno) lo scavalcherebbe
+    m_altra = _ALTRA_OFFSCREEN.search(contenuto)
+    limite = m_altra.start() if m_altra else len(contenuto)
+    for m in _RE_OFFSCREEN.finditer(contenuto, 0, limite):
+        price_text = _span_semplice(m.group(1))
+        if price_text is INCERTO:
+            return INCERTO
+        if '€' in price_text or '$' in price_text:
+            return price_text
+    return INCERTO if m_altra else None
+
+
+def _bs_offscreen_valuta(soup):
+    # Il primo a-offscreen che contiene la valuta, spesso è il prezzo principale.
+    for tag in soup.find_all('span', class_='a-offscreen'):
+        price_text = tag.text.strip()
+        if '€' in price_text or '$' in price_text:
+            return price_text
+    return None
+
+
+SELETTORI_PREZZO = {
+    # Prezzo principale nel box acquisto (era il selettore di ProfitBot)
+    'a_price_aok': (_veloce_offscreen_figlio(_RE_A_PRICE_AOK, _ALTRA_A_PRICE_AOK), _bs_offscreen_figlio('a-price aok-align-center')),
+    # Primo a-price della pagina con a-offscreen
+    'a_price': (_veloce_offscreen_figlio(_RE_A_PRICE, _ALTRA_A_PRICE), _bs_offscreen_figlio('a-price')),
+    # Offerte lampo / prezzo barrato (layout vecchio)
+    'priceblock': (_veloce_priceblock, _bs_priceblock),
+    # Variazioni / core price feature
+    'core_price': (None, _bs_core_price),
+    # Ultima risorsa: qualsiasi a-offscreen con la valuta
+    'offscreen_valuta': (_veloce_offscreen_valuta, _bs_offscreen_valuta),
+}
+
+CATENA_PREZZO = [
+    nome.strip() for nome in os.getenv('SCRAPER_CATENA_PREZZO', 'a_price_aok,a_price,priceblock,core_price,offscreen_valuta').split(',')
+    if nome.strip() in SELETTORI_PREZZO
+]
+# Con SCRAPER_RIORDINA_CATENA=1 il cruiser rimette in testa i selettori che trovano più spesso il prezzo
+RIORDINA_CATENA = os.getenv('SCRAPER_RIORDINA_CATENA', '0') == '1'
+
+_statistiche_selettori = {nome: {'tentativi': 0, 'successi': 0} for nome in SELETTORI_PREZZO}
+
+
+def _estrai_veloce(contenuto, catena):
+    """(titolo, prezzo, selettore, provati, disponibilità) dal percorso veloce, o None se deve decidere BeautifulSoup."""
+    titolo = _veloce_titolo(contenuto)
+    if titolo is None or titolo is INCERTO:
+        return None
+
+    prezzo, vincente, provati = None, None, []
+    for nome in catena:
+        veloce, _ = SELETTORI_PREZZO[nome]
+        if veloce is None:
+            return None
+        risultato = veloce(contenuto)
+        if risultato is INCERTO:
+            return None
+        provati.append(nome)
+        if risultato:
+            prezzo, vincente = risultato, nome
+            break
+    if not titolo or not prezzo:
+        return None
+
+    disponibilita = _veloce_disponibilita(contenuto)
+    if disponibilita is INCERTO:
+        return None
+    return titolo, prezzo, vincente, provati, disponibilita
+
+
+def _estrai_bs4(contenuto, catena):
+    soup = BeautifulSoup(contenuto, 'html.parser')
+    title_tag = soup.find('span', id='productTitle')
+    titolo = title_tag.text.strip() if title_tag else None
+
+    prezzo, vincente, provati = None, None, []
+    for nome in catena:
+        _, completo = SELETTORI_PREZZO[nome]
+        provati.append(nome)
+        prezzo = completo(soup)
+        if prezzo:
+            vincente = nome
+            break
+
+    oos_tag = soup.find('div', id='availability')
+    disponibilita = oos_tag.text if oos_tag else ""
+    return titolo, prezzo, vincente, provati, disponibilita
+
+
+def estrai_dati_prodotto(contenuto, catena=None):
+    """Titolo, prezzo (testo grezzo) e testo disponibilità da una pagina prodotto Amazon.
+
+    Restituisce un dict con anche il selettore che ha trovato il prezzo, il percorso
+    usato ('veloce' o 'bs4') e il tempo di parsing in secondi.
+    """
+    catena = list(catena or CATENA_PREZZO)
+    inizio = time.perf_counter()
+    risultato = _estrai_veloce(contenuto, catena)
+    percorso = 'veloce'
+    if risultato is None:
+        risultato = _estrai_bs4(contenuto, catena)
+        percorso = 'bs4'
+    tempo = time.perf_counter() - inizio
+    titolo, prezzo, vincente, provati, disponibilita = risultato
+
+    registra_tempo_parsing(percorso, tempo)
+    with _lock:
+        for nome in provati:
+            _statistiche_selettori[nome]['tentativi'] += 1
+        if vincente:
+            _statistiche_selettori[vincente]['successi'] += 1
+
+    return {
+        'titolo': titolo,
+        'prezzo': prezzo,
+        'disponibilita': disponibilita,
+        'selettore': vincente,
+        'percorso': percorso,
+        'tempo_parsing': tempo,
+    }
+
+
+def statistiche_selettori():
+    """Per ogni selettore della catena (in ordine): tentativi, successi e hit rate in %."""
+    with _lock:
+        return {
+            nome: {
+                'tentativi': _statistiche_selettori[nome]['tentativi'],
+                'successi': _statistiche_selettori[nome]['successi'],
+                'hit_rate': round(100 * _statistiche_selettori[nome]['successi'] / _statistiche_selettori[nome]['tentativi'], 1)
+                if _statistiche_selettori[nome]['tentativi'] else 0.0,
+            }
+            for nome in CATENA_PREZZO
+        }
+
+
+def riordina_catena():
+    """Mette in testa i selettori che trovano il prezzo più spesso (ordinamento stabile)."""
+    with _lock:
+        CATENA_PREZZO.sort(key=lambda nome: -_statistiche_selettori[nome]['successi'])
+    return list(CATENA_PREZZO)
+
+
+# --- TEMPI DI PARSING ---
+_tempi_parsing = {'veloce': [], 'bs4': []}
+
+
+def registra_tempo_parsing(percorso, secondi):
+    """percorso: 'veloce' o 'bs4'. Si tengono gli ultimi 1000 tempi per percorso."""
+    with _lock:
+        tempi = _tempi_parsing[percorso]
+        tempi.append(secondi)
+        if len(tempi) > 1000:
+            del tempi[0]
+
+
+def statistiche_parsing():
+    """Pagine, media e massimo in millisecondi per ciascun percorso di parsing."""
+    with _lock:
+        return {
+            percorso: {
+                'pagine': len(tempi),
+                'media_ms': round(1000 * sum(tempi) / len(tempi), 2) if tempi else 0.0,
+                'max_ms': round(1000 * max(tempi), 2) if tempi else 0.0,
+            }
+            for percorso, tempi in _tempi_parsing.items()
+        }
+
+# --- CACHE PAGINE PER ASIN ---
+_locale = threading.local()
+_scritture_cache = 0
+
+
+def _connessione_cache():
+    conn = getattr(_locale, 'conn_cache', None)
+    if conn is None:
+        conn = sqlite3.connect(CACHE_FILE, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS pagine (
+                asin TEXT PRIMARY KEY,
+                titolo TEXT,
+                prezzo TEXT,
+                disponibilita TEXT,
+                salvato REAL,
+                usato REAL
+            );
+            CREATE INDEX IF NOT EXISTS idx_pagine_usato ON pagine(usato);
+        """)
+        _locale.conn_cache = conn
+    return conn
+
+
+def leggi_cache(asin, ttl=None):
+    """Dati estratti di recente per l'ASIN ({'titolo', 'prezzo', 'disponibilita', 'eta'}) o None."""
+    ttl = CACHE_TTL_SECONDI if ttl is None else ttl
+    try:
+        conn = _connessione_cache()
+        row = conn.execute("SELECT titolo, prezzo, disponibilita, salvato FROM pagine WHERE asin = ?", (asin,)).fetchone()
+        adesso = time.time()
+        if not row or adesso - row[3] > ttl:
+            return None
+        with conn:
+            conn.execute("UPDATE pagine SET usato = ? WHERE asin = ?", (adesso, asin))
+        return {'titolo': row[0], 'prezzo': row[1], 'disponibilita': row[2], 'eta': adesso - row[3]}
+    except sqlite3.Error as e:
+        print(f"Errore lettura cache pagine: {e}")
+        return None
+
+
+def scrivi_cache(asin, dati_pagina):
+    """Salva titolo/prezzo/disponibilità estratti; ogni 100 scritture applica TTL e limite di voci."""
+    global _scritture_cache
+    try:
+        conn = _connessione_cache()
+        adesso = time.time()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO pagine (asin, titolo, prezzo, disponibilita, salvato, usato) VALUES (?, ?, ?, ?, ?, ?)",
+                (asin, dati_pagina.get('titolo'), dati_pagina.get('prezzo'), dati_pagina.get('disponibilita'), adesso, adesso)
+            )
+        with _lock:
+            _scritture_cache += 1
+            da_pulire = _scritture_cache % 100 == 0
+        if da_pulire:
+            pulisci_cache()
+    except sqlite3.Error as e:
+        print(f"Errore scrittura cache pagine: {e}")
+
+
+def pulisci_cache():
+    """Elimina le voci scadute e, oltre CACHE_MAX_VOCI, quelle usate meno di recente."""
+    conn = _connessione_cache()
+    with conn:
+        conn.execute("DELETE FROM pagine WHERE salvato < ?", (time.time() - CACHE_TTL_SECONDI,))
+        conn.execute(
+            "DELETE FROM pagine WHERE asin IN (SELECT asin FROM pagine ORDER BY usato DESC LIMIT -1 OFFSET ?)",
+            (CACHE_MAX_VOCI,)
+        )